@@ -0,0 +1,190 @@
+"""ASGI entry point for the remote browser; serve.py runs it in production.
+
+The hot routes (input, navigation, frame streams and the viewer channel)
+are async: WebDriver work is queued on each session's driver thread and
+awaited without holding a thread, and streams wait for frames on the event
+loop, so idle viewers cost no threads at all. Everything else is the Flask
+app from v5.py, run in a bounded thread pool.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from websockets.exceptions import ConnectionClosed
+
+import v5
+from channel import ViewerChannel
+from sessions import SessionLimitError
+from scheduler import PRIORITY_CAPTURE, PRIORITY_INPUT
+
+# Threads for blocking work that is not a driver command, such as starting and
+# closing sessions. The Flask routes run in a separate pool of as many threads
+# that a2wsgi keeps for itself.
+BLOCKING_THREADS = 16
+CHANNEL_PATH = "/channel"
+
+blocking_pool = ThreadPoolExecutor(BLOCKING_THREADS, thread_name_prefix="blocking")
+# The page opens its channel on our own port instead of CHANNEL_PORT.
+v5.CHANNEL_PATH = CHANNEL_PATH
+
+
+async def blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(blocking_pool, partial(fn, *args))
+
+
+async def driver_call(session, fn, *args, priority: int):
+    """Queues `fn` on the session's driver thread and waits for it without a thread."""
+    return await asyncio.wrap_future(session.scheduler.submit(fn, *args, priority=priority))
+
+
+async def current_session(connection) -> v5.BrowserSession:
+    """Like v5.current_session(), for a Starlette request or WebSocket."""
+    session_id = v5.resolve_session_id(connection.query_params.get('session'),
+                                       connection.headers.get('X-Session-Id'),
+                                       connection.cookies.get(v5.SESSION_COOKIE))
+    if session_id is None:
+        raise HTTPException(400, 'Invalid session id')
+    session = await blocking(v5.sessions.get, session_id)
+    session.touch()
+    return session
+
+
+async def navigate(request):
+    form = parse_qs((await request.body()).decode())
+    url = form.get('url', [None])[0]
+    if not url:
+        return JSONResponse({'status': 'error', 'message': 'No URL provided'})
+    session = await current_session(request)
+    try:
+        job = session.navigate(url)
+    except RuntimeError as e:
+        return JSONResponse({'status': 'error', 'message': str(e)})
+    return JSONResponse({'status': 'success', 'job_id': job.id, 'job': job.to_dict()})
+
+
+async def navigation_status(request):
+    session = await current_session(request)
+    job = session.navigation.get(request.path_params['job_id'])
+    if job is None:
+        return JSONResponse({'status': 'error', 'message': 'Unknown navigation'}, 404)
+    try:
+        if request.method == 'DELETE':
+            await blocking(session.cancel_navigation, job)
+        else:
+            await driver_call(session, session.poll_navigation, job, priority=PRIORITY_CAPTURE)
+    except Exception as e:
+        return JSONResponse({'status': 'error', 'message': str(e), 'job': job.to_dict()})
+    return JSONResponse({'status': 'success', 'job': job.to_dict()})
+
+
+async def interact(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    events, error = v5.interaction_events(data)
+    if error:
+        return JSONResponse({'status': 'error', 'message': error})
+    session = await current_session(request)
+    try:
+        performed = await driver_call(session, session.perform_input, events, priority=PRIORITY_INPUT)
+        session.rate.touch()
+    except Exception as e:
+        return JSONResponse({'status': 'error', 'message': str(e)})
+    return JSONResponse({'status': 'success', 'performed': performed})
+
+
+async def tile_events(session, seq: int):
+    with session.rate.watching():
+        while not session.closed.is_set():
+            if await session.frames.wait_async(seq, timeout=v5.STREAM_TIMEOUT) is None:
+                yield ": keepalive\n\n"
+                continue
+            for frame in session.frames.updates(seq):
+                yield frame.event(seq)
+                seq = frame.seq
+
+
+async def stream_tiles(request):
+    try:
+        seq = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        seq = 0
+    return StreamingResponse(tile_events(await current_session(request), seq),
+                             media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def multipart_frames(session):
+    seq = 0
+    with session.rate.watching():
+        while not session.closed.is_set():
+            frame = await session.frames.wait_async(seq, timeout=v5.STREAM_TIMEOUT)
+            if frame is None:
+                frame = session.frames.latest()
+                if frame is None:
+                    continue
+            seq = frame.seq
+            yield (f"--{v5.STREAM_BOUNDARY}\r\n"
+                   f"Content-Type: {frame.mime}\r\n"
+                   f"Content-Length: {len(frame.data)}\r\n\r\n").encode() + frame.data + b"\r\n"
+
+
+async def stream(request):
+    return StreamingResponse(multipart_frames(await current_session(request)),
+                             media_type=f'multipart/x-mixed-replace; boundary={v5.STREAM_BOUNDARY}',
+                             headers={'Cache-Control': 'no-cache'})
+
+
+async def channel(websocket: WebSocket):
+    try:
+        session = await current_session(websocket)
+    except Exception as e:
+        await websocket.close(1011, str(e)[:120])
+        return
+    await websocket.accept()
+
+    async def receive():
+        try:
+            return await websocket.receive_text()
+        except WebSocketDisconnect:
+            return None
+
+    await ViewerChannel(session, websocket.send_text, receive, frame_timeout=v5.STREAM_TIMEOUT,
+                        disconnected=(WebSocketDisconnect, ConnectionClosed, OSError)).run()
+
+
+async def session_limit_reached(request, e):
+    return JSONResponse({'status': 'error', 'message': str(e)}, 503)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # Save every session's state before the worker goes away.
+    for session_id in list(v5.sessions.sessions()):
+        await blocking(v5.sessions.close, session_id)
+
+
+app = Starlette(
+    routes=[
+        Route('/navigate', navigate, methods=['POST']),
+        Route('/navigate/{job_id}', navigation_status, methods=['GET', 'DELETE']),
+        Route('/interact', interact, methods=['POST']),
+        Route('/stream_tiles', stream_tiles),
+        Route('/stream', stream),
+        WebSocketRoute(CHANNEL_PATH, channel),
+        Mount('/', WSGIMiddleware(v5.app, workers=BLOCKING_THREADS)),
+    ],
+    exception_handlers={SessionLimitError: session_limit_reached},
+    lifespan=lifespan,
+)
+
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import threading
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, urlparse
+
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from scheduler import PRIORITY_CAPTURE, PRIORITY_INPUT
+
+
+class ViewerChannel:
+    """One viewer's bidirectional connection to a browser session.
+
+    Upstream the viewer sends JSON messages:
+
+        {"type": "input", "events": [...], "id": 1}   same events as /interact
+        {"type": "navigate", "url": "..."}
+
+    Downstream it gets frames as in /stream_tiles, input acknowledgements
+    and navigation progress. Frames are only sent once the previous one
+    went out, so a slow viewer catches up from the session's frame buffer
+    or skips to the newest frame instead of queueing.
+
+    `send(text)` and `receive()` are coroutines; `receive()` returns None
+    once the viewer is gone, and `send()` raises one of `disconnected` if
+    it left while we were talking.
+    """
+
+    def __init__(self, session, send, receive, frame_timeout: float = 30,
+                 status_interval: float = 0.25, disconnected: tuple = (ConnectionClosed,)):
+        self.session = session
+        self._send = send
+        self._receive = receive
+        self.disconnected = disconnected
+        self.frame_timeout = frame_timeout
+        self.status_interval = status_interval
+        self._acks = set()
+
+    async def run(self):
+        with self.session.rate.watching():
+            tasks = [asyncio.create_task(coroutine) for coroutine in
+                     (self.send_frames(), self.send_status(), self.receive_messages())]
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            for task in done:
+                if not task.cancelled() and task.exception() and \
+                        not isinstance(task.exception(), self.disconnected):
+                    raise task.exception()
+
+    async def send(self, message: dict):
+        await self._send(json.dumps(message))
+
+    async def send_frames(self):
+        seq = 0
+        while not self.session.closed.is_set():
+            if await self.session.frames.wait_async(seq, timeout=self.frame_timeout) is None:
+                continue
+            for frame in self.session.frames.updates(seq):
+                await self._send(frame.payload(seq))
+                seq = frame.seq
+
+    async def send_status(self):
+        """Reports the state of the session's current navigation whenever it changes."""
+        reported = None
+        while not self.session.closed.is_set():
+            await asyncio.sleep(self.status_interval)
+            job = self.session.navigation.current()
+            if job is None:
+                continue
+            if not job.done:
+                try:
+                    await asyncio.wrap_future(self.session.scheduler.submit(
+                        self.session.poll_navigation, job, priority=PRIORITY_CAPTURE))
+                except Exception as e:
+                    print(f"Error checking navigation {job.id}: {e}")
+            if (job.id, job.state) != reported:
+                reported = (job.id, job.state)
+                await self.send({"type": "navigation", "job": job.to_dict()})
+
+    async def receive_messages(self):
+        while True:
+            text = await self._receive()
+            if text is None:
+                return
+            self.session.touch()
+            try:
+                message = json.loads(text)
+                kind = message.get("type")
+            except (ValueError, AttributeError):
+                await self.send({"type": "error", "message": "Messages must be JSON objects"})
+                continue
+            if kind == "input":
+                # Queued right away so batches keep their order; acknowledged when done.
+                future = self.session.scheduler.submit(
+                    self.session.perform_input, message.get("events") or [], priority=PRIORITY_INPUT)
+                self.session.rate.touch()
+                task = asyncio.create_task(self.acknowledge(message.get("id"), future))
+                self._acks.add(task)
+                task.add_done_callback(self._acks.discard)
+            elif kind == "navigate" and message.get("url"):
+                job = self.session.navigate(message["url"])
+                await self.send({"type": "navigation", "job": job.to_dict()})
+            else:
+                await self.send({"type": "error", "message": f"Unknown message type: {kind}"})
+
+    async def acknowledge(self, message_id, future):
+        try:
+            reply = {"type": "input", "id": message_id, "status": "success",
+                     "performed": await asyncio.wrap_future(future)}
+        except Exception as e:
+            reply = {"type": "input", "id": message_id, "status": "error", "message": str(e)}
+        try:
+            await self.send(reply)
+        except self.disconnected:
+            pass
+
+
+def serve_channels(host: str, port: int, open_session, cookie_name: str) -> threading.Thread:
+    """Serves viewer channels over WebSocket from an event loop on its own thread.
+
+    `open_session(session_id, header_id, cookie_id)` picks the viewer's
+    session the same way the HTTP routes do, raising if it cannot.
+    """
+
+    async def handler(connection):
+        request = connection.request
+        query = parse_qs(urlparse(request.path).query)
+        cookie = SimpleCookie(request.headers.get("Cookie", "")).get(cookie_name)
+        try:
+            session = await asyncio.to_thread(
+                open_session, query.get("session", [None])[0],
+                request.headers.get("X-Session-Id"), cookie.value if cookie else None)
+        except Exception as e:
+            await connection.close(1011, str(e)[:120])
+            return
+
+        async def receive():
+            try:
+                return await connection.recv()
+            except ConnectionClosed:
+                return None
+
+        await ViewerChannel(session, connection.send, receive).run()
+
+    async def main():
+        async with serve(handler, host, port):
+            await asyncio.get_running_loop().create_future()
+
+    thread = threading.Thread(target=asyncio.run, args=(main(),), name="viewer-channels",
+                              daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,178 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from frames import frame_digest
+
+TILE_SIZE = 64
+# Above this share of changed tiles a full frame is cheaper than a delta.
+MAX_DELTA_RATIO = 0.5
+
+# format name -> (PIL format, mime type)
+FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+
+class ImageEncoder:
+    """Encodes frames in one format, optionally downscaled to fit a target size."""
+
+    def __init__(self, format: str = "png", quality: int = 80,
+                 max_width: int = None, max_height: int = None):
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported frame format: {format}")
+        if not 1 <= quality <= 100:
+            raise ValueError(f"Quality must be between 1 and 100, got {quality}")
+        for limit in (max_width, max_height):
+            if limit is not None and (not isinstance(limit, int) or limit <= 0):
+                raise ValueError(f"Target size must be a positive integer, got {limit}")
+        self.format = format
+        self.quality = quality
+        self.max_width = max_width
+        self.max_height = max_height
+
+    @property
+    def mime(self) -> str:
+        return FORMATS[self.format][1]
+
+    def settings(self) -> dict:
+        return {
+            "format": self.format,
+            "quality": self.quality,
+            "max_width": self.max_width,
+            "max_height": self.max_height,
+        }
+
+    def prepare(self, image: Image.Image) -> Image.Image:
+        """Converts to RGB and shrinks the image to the target size, keeping its aspect ratio."""
+        image = image.convert("RGB")
+        if self.max_width or self.max_height:
+            size = (self.max_width or image.width, self.max_height or image.height)
+            if image.width > size[0] or image.height > size[1]:
+                image = image.copy()
+                image.thumbnail(size, Image.BILINEAR)
+        return image
+
+    def encode(self, image: Image.Image) -> bytes:
+        buffered = io.BytesIO()
+        if self.format == "png":
+            image.save(buffered, format="PNG")
+        else:
+            image.save(buffered, format=FORMATS[self.format][0], quality=self.quality)
+        return buffered.getvalue()
+
+
+class TileEncoder:
+    """Splits frames into fixed tiles and encodes only the ones that changed.
+
+    The encoder remembers the last frame it was given, so it must be fed
+    every published frame in order.
+    """
+
+    def __init__(self, tile_size: int = TILE_SIZE, max_ratio: float = MAX_DELTA_RATIO):
+        self.tile_size = tile_size
+        self.max_ratio = max_ratio
+        self._previous = None
+
+    def reset(self):
+        self._previous = None
+
+    def changed_tiles(self, previous: np.ndarray, current: np.ndarray) -> np.ndarray:
+        """Returns a (rows, cols) boolean grid of tiles that differ."""
+        size = self.tile_size
+        height, width = current.shape[:2]
+        rows, cols = -(-height // size), -(-width // size)
+        changed = np.any(previous != current, axis=2)
+        padded = np.zeros((rows * size, cols * size), dtype=bool)
+        padded[:height, :width] = changed
+        return padded.reshape(rows, size, cols, size).any(axis=(1, 3))
+
+    def encode(self, image: Image.Image, encoder: ImageEncoder):
+        """Returns the changed tiles as (x, y, bytes) tuples.
+
+        Returns None when there is no usable previous frame or so much changed
+        that the caller should send a full frame instead.
+        """
+        current = np.asarray(image)
+        previous, self._previous = self._previous, current
+        if previous is None or previous.shape != current.shape:
+            return None
+
+        grid = self.changed_tiles(previous, current)
+        if grid.mean() > self.max_ratio:
+            return None
+
+        size = self.tile_size
+        tiles = []
+        for row, col in zip(*np.nonzero(grid)):
+            x, y = int(col) * size, int(row) * size
+            tile = image.crop((x, y, min(x + size, image.width), min(y + size, image.height)))
+            tiles.append((x, y, encoder.encode(tile)))
+        return tiles
+
+
+class FramePipeline:
+    """Turns raw captures into encoded frames, once per frame for all viewers.
+
+    Each capture is decoded once, downscaled, encoded with the configured
+    codec and diffed into tiles. Captures identical to the previous one are
+    dropped before any of that work happens, and captures that already are
+    in the configured format, size and quality are published as they came in.
+    """
+
+    def __init__(self, encoder: ImageEncoder = None, tile_encoder: TileEncoder = None):
+        self.encoder = encoder or ImageEncoder()
+        self.tile_encoder = tile_encoder or TileEncoder()
+        self._lock = threading.Lock()
+        self._last_digest = None
+        self._generation = 0
+
+    def configure(self, **settings) -> ImageEncoder:
+        """Switches codec settings; the next capture is re-encoded as a key frame."""
+        with self._lock:
+            merged = dict(self.encoder.settings(), **settings)
+            self.encoder = ImageEncoder(**merged)
+            self.tile_encoder.reset()
+            self._last_digest = None
+            self._generation += 1
+            return self.encoder
+
+    def reusable(self, source: Image.Image, image: Image.Image, quality: int = None) -> bool:
+        """Whether a capture can be published without re-encoding it.
+
+        It has to be in the encoder's format and size, and lossy captures
+        also at the encoder's quality, which callers know and pass in.
+        """
+        if source.format != FORMATS[self.encoder.format][0] or image.size != source.size:
+            return False
+        return self.encoder.format == "png" or quality == self.encoder.quality
+
+    def process(self, raw: bytes, quality: int = None):
+        """Returns (data, mime, digest, tiles) for a new capture, or None if it is unchanged.
+
+        `quality` is what the capture was encoded with, if it is lossy.
+        """
+        with self._lock:
+            # Include the settings generation so a re-encoded frame never looks unchanged.
+            digest = f"{frame_digest(raw)}-{self._generation}"
+            if digest == self._last_digest:
+                return None
+
+            try:
+                source = Image.open(io.BytesIO(raw))
+                image = self.encoder.prepare(source)
+                tiles = self.tile_encoder.encode(image, self.encoder)
+                if self.reusable(source, image, quality):
+                    data = raw  # e.g. screencast JPEG, re-encoding would only cost time and bytes
+                else:
+                    data = self.encoder.encode(image)
+            except Exception:
+                # The tile encoder may already hold this frame; start over from a key frame.
+                self.tile_encoder.reset()
+                raise
+            self._last_digest = digest
+            return data, self.encoder.mime, digest, tiles
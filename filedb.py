@@ -0,0 +1,347 @@
+import atexit
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_FILENAME = "db.json"
+
+# Marks a key deleted in the changes handed to a backend.
+DELETED = object()
+
+
+class StorageBackend:
+    """Where a FileDB keeps its data.
+
+    FileDB holds everything in memory and hands the backend the keys that
+    changed since the last save, so backends that can update single keys
+    only pay for what changed.
+    """
+    filename = None
+
+    def load(self) -> dict:
+        raise NotImplementedError
+
+    def save(self, data: dict, changes: dict, cleared: bool) -> None:
+        """Persists `changes` (key -> value or DELETED); `cleared` means
+        everything not in `changes` was removed. `data` is the full state."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class JSONBackend(StorageBackend):
+    """The whole DB as one JSON file, rewritten on every save."""
+
+    def __init__(self, filename: str = DB_FILENAME):
+        self.filename = filename
+
+    def load(self) -> dict:
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, "r") as f:
+                    return json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+        return {}
+
+    def save(self, data: dict, changes: dict, cleared: bool) -> None:
+        text = json.dumps(data, indent=2)
+        tmp_filename = f"{self.filename}.tmp"
+        with open(tmp_filename, "w") as f:
+            f.write(text)
+        os.replace(tmp_filename, self.filename)
+
+
+def key_kind(key: str) -> str:
+    """Namespace of a key as laid out by StateStore, see state.py."""
+    if key.startswith("cookie:"):
+        return "cookie"
+    if key.startswith("ls:"):
+        return "localstorage"
+    if key.startswith("ss:"):
+        return "sessionstorage"
+    if key.startswith("idb:"):
+        return "indexeddb"
+    return "other"
+
+
+class SQLiteBackend(StorageBackend):
+    """One row per key in an SQLite file that many sessions and processes can share.
+
+    Rows are keyed by (namespace, key), usually one namespace per session,
+    and indexed by key kind. SQLite's own locking keeps concurrent writers
+    from clobbering each other, and a save only touches the changed rows.
+    """
+
+    def __init__(self, filename: str, namespace: str = "default"):
+        self.filename = filename
+        self.namespace = namespace
+        self._conn = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, kind TEXT NOT NULL,"
+                " value TEXT NOT NULL, PRIMARY KEY (namespace, key))")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_kind ON entries (namespace, kind)")
+
+    def load(self) -> dict:
+        rows = self._conn.execute(
+            "SELECT key, value FROM entries WHERE namespace = ?", (self.namespace,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def save(self, data: dict, changes: dict, cleared: bool) -> None:
+        upserts = [(self.namespace, key, key_kind(key), json.dumps(value))
+                   for key, value in changes.items() if value is not DELETED]
+        deletes = [(self.namespace, key) for key, value in changes.items() if value is DELETED]
+        with self._conn:
+            if cleared:
+                self._conn.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+            self._conn.executemany(
+                "INSERT INTO entries (namespace, key, kind, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET kind = excluded.kind, value = excluded.value",
+                upserts)
+            self._conn.executemany(
+                "DELETE FROM entries WHERE namespace = ? AND key = ?", deletes)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class LogBackend(StorageBackend):
+    """Appends every change as a JSON line and replays the log on load.
+
+    Once the log holds `compact_ratio` times more lines than there are live
+    keys it is rewritten to just the current state. Appends and compaction
+    take an exclusive lock on the file, so several processes can share it:
+    compaction replays the whole log under the lock, other processes'
+    lines included, and appenders that waited on a log since replaced by a
+    compaction reopen it before writing.
+    """
+
+    def __init__(self, filename: str, compact_ratio: int = 4, compact_min: int = 1000):
+        self.filename = filename
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self._lines = 0
+
+    @staticmethod
+    def replay(f) -> tuple:
+        """The state a log file describes, and how many lines it took."""
+        data, lines = {}, 0
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn write at the end of the log
+            lines += 1
+            if entry["op"] == "set":
+                data[entry["key"]] = entry["value"]
+            elif entry["op"] == "del":
+                data.pop(entry["key"], None)
+            elif entry["op"] == "clear":
+                data.clear()
+        return data, lines
+
+    @contextmanager
+    def _locked(self):
+        """The log opened for appending, with an exclusive lock on the current file."""
+        while True:
+            f = open(self.filename, "a+")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                current = os.fstat(f.fileno()).st_ino == os.stat(self.filename).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                break
+            # Compacted while we waited for the lock; what we hold is the unlinked old log.
+            f.close()
+        try:
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def load(self) -> dict:
+        if not os.path.exists(self.filename):
+            self._lines = 0
+            return {}
+        with open(self.filename, "r") as f:
+            data, self._lines = self.replay(f)
+        return data
+
+    def save(self, data: dict, changes: dict, cleared: bool) -> None:
+        lines = [json.dumps({"op": "clear"})] if cleared else []
+        for key, value in changes.items():
+            if value is DELETED:
+                lines.append(json.dumps({"op": "del", "key": key}))
+            else:
+                lines.append(json.dumps({"op": "set", "key": key, "value": value}))
+        with self._locked() as f:
+            f.write("".join(line + "\n" for line in lines))
+            f.flush()
+            self._lines += len(lines)
+            if self._lines > max(self.compact_min, self.compact_ratio * len(data)):
+                self._compact(f)
+
+    def compact(self) -> None:
+        """Rewrites the log as one line per live key."""
+        with self._locked() as f:
+            self._compact(f)
+
+    def _compact(self, f) -> None:
+        f.seek(0)
+        data, _ = self.replay(f)
+        tmp_filename = f"{self.filename}.tmp"
+        with open(tmp_filename, "w") as tmp:
+            for key, value in data.items():
+                tmp.write(json.dumps({"op": "set", "key": key, "value": value}) + "\n")
+        os.replace(tmp_filename, self.filename)
+        self._lines = len(data)
+
+
+class FileDB(dict):
+    """File-based key-value storage.
+
+    Every mutation is written through to the backend unless it happens
+    inside `batch()`, or the DB was opened with a `flush_interval`, in which
+    case changes are coalesced and written by a background thread.
+    """
+    def __init__(self, filename: str = DB_FILENAME, flush_interval: float = None,
+                 backend: StorageBackend = None):
+        self.backend = backend or JSONBackend(filename)
+        self.filename = self.backend.filename
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._changes = {}
+        self._cleared = False
+        # Old value (or DELETED) of each key changed in the running batch.
+        self._undo = None
+        self._closed = threading.Event()
+        self.load()
+        if flush_interval:
+            threading.Thread(target=self._flush_periodically, daemon=True,
+                             name=f"filedb-{os.path.basename(self.filename)}").start()
+            atexit.register(self.flush)
+
+    def load(self):
+        with self._lock:
+            super().clear()
+            super().update(self.backend.load())
+            self._changes, self._cleared = {}, False
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._changes) or self._cleared
+
+    def _save(self):
+        with self._lock:
+            changes, cleared = self._changes, self._cleared
+            self._changes, self._cleared = {}, False
+            try:
+                self.backend.save(self, changes, cleared)
+            except (IOError, sqlite3.Error) as e:
+                # Keep the changes so the next save retries them.
+                self._changes = dict(changes, **self._changes)
+                self._cleared = cleared or self._cleared
+                print(f"Error saving to {self.filename}: {e}")
+
+    def _remember(self, key):
+        if self._undo is not None and key not in self._undo:
+            self._undo[key] = dict.get(self, key, DELETED)
+
+    def _changed(self, key, value):
+        with self._lock:
+            self._changes[key] = value
+            if not self._batch_depth and not self.flush_interval:
+                self._save()
+
+    def flush(self):
+        """Writes pending changes now."""
+        with self._lock:
+            if self.dirty:
+                self._save()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+        self.backend.close()
+        if self.flush_interval:
+            atexit.unregister(self.flush)
+
+    @contextmanager
+    def batch(self):
+        """Applies all changes made in the block with a single write.
+
+        If the block raises, the DB is rolled back to where it was before.
+        Other threads are kept out until the block ends.
+        """
+        with self._lock:
+            if not self._batch_depth:
+                self._undo = {}
+                pending = (dict(self._changes), self._cleared)
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                if self._batch_depth == 1:
+                    for key, value in self._undo.items():
+                        if value is DELETED:
+                            super().pop(key, None)
+                        else:
+                            super().__setitem__(key, value)
+                    self._changes, self._cleared = pending
+                raise
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self._undo = None
+            if not self._batch_depth and self.dirty and not self.flush_interval:
+                self._save()
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._remember(key)
+            super().__setitem__(key, value)
+            self._changed(key, value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key in self:
+                self._remember(key)
+            super().__delitem__(key)
+            self._changed(key, DELETED)
+
+    def update(self, *args, **kwargs):
+        with self._lock, self.batch():
+            for key, value in dict(*args, **kwargs).items():
+                self[key] = value
+
+    def pop(self, key, *default):
+        with self._lock:
+            if key not in self:
+                return super().pop(key, *default)
+            self._remember(key)
+            value = super().pop(key)
+            self._changed(key, DELETED)
+            return value
+
+    def clear(self):
+        with self._lock:
+            for key in self:
+                self._remember(key)
+            super().clear()
+            self._changes, self._cleared = {}, True
+            if not self._batch_depth and not self.flush_interval:
+                self._save()
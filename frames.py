@@ -0,0 +1,241 @@
+import asyncio
+import base64
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from time import monotonic, time
+
+
+def frame_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class Frame:
+    """A single captured screenshot as published to viewers."""
+
+    def __init__(self, seq: int, data: bytes, mime: str = "image/png", digest: str = None,
+                 tiles: list = None, base_seq: int = 0):
+        self.seq = seq
+        self.data = data
+        self.mime = mime
+        self.digest = digest or frame_digest(data)
+        # Changed (x, y, bytes) tiles relative to frame `base_seq`, if known.
+        self.tiles = tiles
+        self.base_seq = base_seq
+        self.timestamp = time()
+        self._payloads = {}
+
+    @property
+    def delta_size(self) -> int:
+        """Bytes of changed tiles a viewer with the base frame needs."""
+        if self.tiles is None:
+            return len(self.data)
+        return sum(len(data) for _, _, data in self.tiles)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.seq}-{self.digest}"'
+
+    def seen_by(self, since: int) -> bool:
+        """Whether a viewer that last got frame `since` already has this one.
+
+        Only an exact match counts: a viewer ahead of us saw a session that
+        has since been recreated and needs this frame.
+        """
+        return since == self.seq
+
+    def payload(self, after_seq: int) -> str:
+        """JSON message carrying this frame for a viewer that has `after_seq`.
+
+        Viewers that have the base frame get only the changed tiles, everyone
+        else gets a key frame. Both payloads are built once and shared.
+        """
+        key = self.tiles is None or after_seq != self.base_seq
+        if key not in self._payloads:
+            tiles = [(0, 0, self.data)] if key else self.tiles
+            self._payloads[key] = json.dumps({
+                "type": "frame",
+                "seq": self.seq,
+                "key": key,
+                "mime": self.mime,
+                "tiles": [{"x": x, "y": y, "data": base64.b64encode(data).decode("utf-8")}
+                          for x, y, data in tiles],
+            })
+        return self._payloads[key]
+
+    def event(self, after_seq: int) -> str:
+        """The payload as a server-sent event, with the sequence number as its id."""
+        return f"id: {self.seq}\ndata: {self.payload(after_seq)}\n\n"
+
+
+class FrameBuffer:
+    """Ring buffer of the last `size` frames, shared by all viewers of a session.
+
+    The capture thread is the only writer. Readers never take a lock to
+    look at frames: each slot and the newest frame are swapped in with a
+    single reference assignment, so every viewer reads at its own pace and
+    a slow one never holds up the producer. Threads block in wait();
+    coroutines await wait_async(), which costs no thread while waiting.
+    """
+
+    def __init__(self, size: int = 8):
+        self.size = size
+        self._ring = [None] * size
+        self._frame = None
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+
+    def publish(self, data: bytes, mime: str = "image/png", digest: str = None,
+                tiles: list = None):
+        """Publishes a frame unless it is identical to the current one.
+
+        Returns the new frame, or None when nothing changed. Unchanged frames
+        keep their sequence number so waiting viewers are not woken up.
+        """
+        digest = digest or frame_digest(data)
+        if self._frame is not None and self._frame.digest == digest:
+            return None
+        frame = Frame(self._seq + 1, data, mime, digest, tiles, self._seq)
+        # Fill the slot before announcing the frame, so whoever sees it can find it.
+        self._ring[frame.seq % self.size] = frame
+        self._seq = frame.seq
+        self._frame = frame
+        with self._cond:
+            self._cond.notify_all()
+            for loop, event in self._async_waiters:
+                try:
+                    loop.call_soon_threadsafe(event.set)
+                except RuntimeError:
+                    pass  # loop already closed
+        return frame
+
+    def latest(self):
+        return self._frame
+
+    def get(self, seq: int):
+        """Frame `seq` if it is still buffered."""
+        frame = self._ring[seq % self.size]
+        return frame if frame is not None and frame.seq == seq else None
+
+    def updates(self, after_seq: int) -> list:
+        """Frames to send a viewer that has frame `after_seq`, oldest first.
+
+        A viewer that is only a little behind gets every delta it missed, as
+        long as they are all still buffered and add up to less than a key
+        frame. Anyone further behind skips straight to the newest frame, and
+        so does one claiming to be ahead of us, e.g. resuming a stream from
+        before the session was recreated.
+        """
+        newest = self._frame
+        if newest is None or newest.seq == after_seq:
+            return []
+        if not after_seq or newest.seq < after_seq or newest.seq - after_seq == 1:
+            return [newest]
+        missed = [self.get(seq) for seq in range(after_seq + 1, newest.seq + 1)]
+        if None in missed or any(frame.tiles is None for frame in missed) \
+                or sum(frame.delta_size for frame in missed) >= len(newest.data):
+            return [newest]
+        return missed
+
+    @staticmethod
+    def _has_update(frame, after_seq: int) -> bool:
+        return frame is not None and frame.seq != after_seq
+
+    def wait(self, after_seq: int = 0, timeout: float = None):
+        """Blocks until there is a frame other than `after_seq` to send.
+
+        That is a newer frame, or any frame if `after_seq` is ahead of the
+        buffer. Returns the newest frame, or None if the timeout expired first.
+        """
+        frame = self._frame
+        if self._has_update(frame, after_seq):
+            return frame
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._has_update(self._frame, after_seq), timeout):
+                return None
+            return self._frame
+
+    async def wait_async(self, after_seq: int = 0, timeout: float = None):
+        """Like wait(), for coroutines; publish() wakes them on their own event loop."""
+        frame = self._frame
+        if self._has_update(frame, after_seq):
+            return frame
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            if self._has_update(self._frame, after_seq):
+                return self._frame
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+        return self.latest()
+
+
+class RateController:
+    """Decides how often to capture, based on who is watching and what is happening.
+
+    Captures run every `active_interval` while someone is watching and the
+    page changed or received input recently, slow down to `idle_interval`
+    once it has been quiet for `idle_after` seconds, and stop altogether
+    while nobody is watching. Input wakes a sleeping capture loop at once.
+    """
+
+    def __init__(self, active_interval: float, idle_interval: float, idle_after: float):
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.idle_after = idle_after
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._viewers = 0
+        self._last_poll = 0.0
+        self._last_activity = monotonic()
+
+    @property
+    def viewers(self) -> int:
+        with self._lock:
+            return self._viewers
+
+    @contextmanager
+    def watching(self):
+        """Counts a streaming viewer for as long as the block runs."""
+        with self._lock:
+            self._viewers += 1
+        self.touch()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._viewers -= 1
+
+    def polled(self):
+        """Records a polling viewer, which counts as watching for `idle_after` seconds."""
+        with self._lock:
+            self._last_poll = monotonic()
+        self._wake.set()
+
+    def touch(self):
+        """Records input or a page change and wakes the capture loop."""
+        with self._lock:
+            self._last_activity = monotonic()
+        self._wake.set()
+
+    def interval(self):
+        """Seconds until the next capture, or None to pause until woken."""
+        now = monotonic()
+        with self._lock:
+            if not self._viewers and now - self._last_poll > self.idle_after:
+                return None
+            if now - self._last_activity > self.idle_after:
+                return self.idle_interval
+            return self.active_interval
+
+    def wait(self):
+        """Sleeps until the next capture is due or something wakes us up."""
+        self._wake.clear()
+        self._wake.wait(self.interval())
@@ -0,0 +1,329 @@
+import threading
+
+from selenium.webdriver import Chrome
+from selenium.webdriver.common.actions.action_builder import ActionBuilder
+from selenium.webdriver.common.actions.mouse_button import MouseButton
+from selenium.webdriver.common.keys import Keys
+
+# Modifier flags of DevTools Input events, set from the viewer event's booleans.
+MODIFIERS = {"alt": 1, "ctrl": 2, "meta": 4, "shift": 8}
+# MouseEvent.button -> DevTools button name, and the bit it sets in `buttons`.
+BUTTONS = {0: "left", 1: "middle", 2: "right"}
+BUTTON_MASKS = {"left": 1, "right": 2, "middle": 4}
+
+# KeyboardEvent.key -> (Windows virtual key code, text the key types) for keys
+# that are not a single printable character.
+KEYS = {
+    "Enter": (13, "\r"),
+    "Backspace": (8, None),
+    "Tab": (9, None),
+    "Escape": (27, None),
+    "PageUp": (33, None),
+    "PageDown": (34, None),
+    "End": (35, None),
+    "Home": (36, None),
+    "ArrowLeft": (37, None),
+    "ArrowUp": (38, None),
+    "ArrowRight": (39, None),
+    "ArrowDown": (40, None),
+    "Insert": (45, None),
+    "Delete": (46, None),
+    "Shift": (16, None),
+    "Control": (17, None),
+    "Alt": (18, None),
+    "Meta": (91, None),
+}
+KEYS.update({f"F{n}": (111 + n, None) for n in range(1, 13)})
+
+# The same keys and buttons as W3C Actions know them.
+W3C_KEYS = {
+    "Enter": Keys.ENTER,
+    "Backspace": Keys.BACKSPACE,
+    "Tab": Keys.TAB,
+    "Escape": Keys.ESCAPE,
+    "PageUp": Keys.PAGE_UP,
+    "PageDown": Keys.PAGE_DOWN,
+    "End": Keys.END,
+    "Home": Keys.HOME,
+    "ArrowLeft": Keys.ARROW_LEFT,
+    "ArrowUp": Keys.ARROW_UP,
+    "ArrowRight": Keys.ARROW_RIGHT,
+    "ArrowDown": Keys.ARROW_DOWN,
+    "Insert": Keys.INSERT,
+    "Delete": Keys.DELETE,
+    "Shift": Keys.SHIFT,
+    "Control": Keys.CONTROL,
+    "Alt": Keys.ALT,
+    "Meta": Keys.META,
+}
+W3C_KEYS.update({f"F{n}": getattr(Keys, f"F{n}") for n in range(1, 13)})
+W3C_BUTTONS = {"left": MouseButton.LEFT, "middle": MouseButton.MIDDLE, "right": MouseButton.RIGHT}
+
+
+class Viewport:
+    """Cached size of the page's viewport in CSS pixels, the space input events use.
+
+    Kept up to date from screencast frame metadata where possible;
+    `measure()` asks the browser only when nothing is cached, e.g. after a
+    resize or navigation invalidated it.
+    """
+
+    def __init__(self, measure):
+        self._measure = measure
+        self._size = None
+        self._lock = threading.Lock()
+
+    def size(self):
+        with self._lock:
+            size = self._size
+        if size is None:
+            size = self._measure()
+            self.update(*size)
+        return size
+
+    def update(self, width, height):
+        with self._lock:
+            self._size = (width, height)
+
+    def invalidate(self):
+        with self._lock:
+            self._size = None
+
+
+class InputDispatcher:
+    """Translates viewer input events into DevTools Input commands.
+
+    Each event type has one entry in HANDLERS, which returns the
+    (method, params) commands for it. The dispatcher remembers the pointer
+    position and the pressed buttons between events, so moves between a
+    mousedown and a mouseup arrive as drags.
+
+    Pointer coordinates are relative to the viewer's image; events carrying
+    the image's `width` and `height` get scaled to the `viewport`.
+    """
+
+    def __init__(self, viewport: Viewport):
+        self.viewport = viewport
+        self.position = (0, 0)
+        self.buttons = 0
+
+    def translate(self, events: list):
+        """Commands for a batch of events, and how many events produced any."""
+        commands, handled = [], 0
+        for event in events:
+            handler = self.HANDLERS.get(event.get("type"))
+            event_commands = handler(self, event) if handler else None
+            if event_commands:
+                commands.extend(event_commands)
+                handled += 1
+        return commands, handled
+
+    def _modifiers(self, event: dict) -> int:
+        return sum(flag for name, flag in MODIFIERS.items() if event.get(name))
+
+    def _move_to(self, event: dict) -> bool:
+        x, y = event.get("x"), event.get("y")
+        if x is None or y is None:
+            return False
+        width, height = event.get("width"), event.get("height")
+        if width and height:
+            viewport_width, viewport_height = self.viewport.size()
+            x = min(x * viewport_width / width, viewport_width - 1)
+            y = min(y * viewport_height / height, viewport_height - 1)
+        self.position = (max(int(x), 0), max(int(y), 0))
+        return True
+
+    def _mouse(self, kind: str, event: dict, button: str = "none", count: int = 0) -> tuple:
+        x, y = self.position
+        return ("Input.dispatchMouseEvent", {
+            "type": kind, "x": x, "y": y, "button": button, "buttons": self.buttons,
+            "clickCount": count, "modifiers": self._modifiers(event)})
+
+    def _button(self, event: dict) -> str:
+        button = event.get("button", 0)
+        return button if button in BUTTON_MASKS else BUTTONS.get(button, "left")
+
+    def _pressed_button(self) -> str:
+        for name, mask in BUTTON_MASKS.items():
+            if self.buttons & mask:
+                return name
+        return "none"
+
+    def _move(self, event: dict):
+        if not self._move_to(event):
+            return None
+        return [self._mouse("mouseMoved", event, self._pressed_button())]
+
+    def _mousedown(self, event: dict):
+        self._move_to(event)
+        button = self._button(event)
+        self.buttons |= BUTTON_MASKS[button]
+        return [self._mouse("mousePressed", event, button, event.get("count") or 1)]
+
+    def _mouseup(self, event: dict):
+        self._move_to(event)
+        button = self._button(event)
+        self.buttons &= ~BUTTON_MASKS[button]
+        return [self._mouse("mouseReleased", event, button, event.get("count") or 1)]
+
+    def _click(self, event: dict, count: int = 1):
+        if not self._move_to(event):
+            return None
+        button = self._button(event)
+        commands = [self._mouse("mouseMoved", event)]
+        for n in range(1, count + 1):
+            self.buttons |= BUTTON_MASKS[button]
+            commands.append(self._mouse("mousePressed", event, button, n))
+            self.buttons &= ~BUTTON_MASKS[button]
+            commands.append(self._mouse("mouseReleased", event, button, n))
+        return commands
+
+    def _dblclick(self, event: dict):
+        return self._click(event, 2)
+
+    def _scroll(self, event: dict):
+        self._move_to(event)
+        delta_x, delta_y = event.get("delta_x") or 0, event.get("delta_y") or 0
+        if not delta_x and not delta_y:
+            return None
+        command = self._mouse("mouseWheel", event)
+        command[1].update(deltaX=delta_x, deltaY=delta_y)
+        return [command]
+
+    def _key(self, kind: str, event: dict):
+        key = event.get("key")
+        if not key:
+            return None
+        modifiers = self._modifiers(event)
+        if key in KEYS:
+            code, text = KEYS[key]
+        elif len(key) == 1:
+            code = ord(key.upper()) if key.isascii() and key.isalnum() else 0
+            # With Ctrl, Alt or Meta held a key is a shortcut and types nothing.
+            text = None if modifiers & ~MODIFIERS["shift"] else key
+        else:
+            return None
+        params = {"type": kind, "key": key, "code": event.get("code", ""), "modifiers": modifiers,
+                  "windowsVirtualKeyCode": code, "nativeVirtualKeyCode": code}
+        if kind == "keyDown":
+            if text:
+                params.update(text=text, unmodifiedText=text)
+            else:
+                params["type"] = "rawKeyDown"
+        return [("Input.dispatchKeyEvent", params)]
+
+    def _keydown(self, event: dict):
+        return self._key("keyDown", event)
+
+    def _keyup(self, event: dict):
+        return self._key("keyUp", event)
+
+    def _keypress(self, event: dict):
+        down = self._key("keyDown", event)
+        return down and down + self._key("keyUp", event)
+
+    def _text(self, event: dict):
+        if not event.get("text"):
+            return None
+        return [("Input.insertText", {"text": event["text"]})]
+
+    HANDLERS = {
+        "move": _move,
+        "hover": _move,
+        "mousedown": _mousedown,
+        "mouseup": _mouseup,
+        "click": _click,
+        "dblclick": _dblclick,
+        "scroll": _scroll,
+        "wheel": _scroll,
+        "keydown": _keydown,
+        "keyup": _keyup,
+        "keypress": _keypress,
+        "text": _text,
+    }
+
+
+class ActionsBatch:
+    """Replays InputDispatcher's commands as one W3C Actions sequence.
+
+    For when there is no DevTools connection of our own to send them on:
+    chromedriver then takes the whole batch in a single command instead of
+    one execute_cdp_cmd per event. W3C Actions run their devices side by
+    side, one action per device per tick, so after every command the idle
+    devices are padded with pauses to keep everything in order. Modifiers
+    come from the modifier keys' own key events, and click counts from the
+    timing of the presses, as in a real browser.
+    """
+
+    def __init__(self, driver: Chrome, commands: list = ()):
+        self.builder = ActionBuilder(driver, duration=0)
+        self.count = 0
+        self._position = None
+        for method, params in commands:
+            self.add(method, params)
+
+    def add(self, method: str, params: dict) -> bool:
+        """Adds one DevTools Input command; returns False for ones we cannot replay."""
+        handler = self.HANDLERS.get(method)
+        if handler is None or not handler(self, params):
+            return False
+        self._align()
+        self.count += 1
+        return True
+
+    def perform(self) -> int:
+        """Sends the batch to the browser; returns the number of commands in it."""
+        if self.count:
+            self.builder.perform()
+        return self.count
+
+    def _align(self):
+        devices = self.builder.devices
+        ticks = max(len(device.actions) for device in devices)
+        for device in devices:
+            while len(device.actions) < ticks:
+                device.create_pause(0)
+
+    def _move_to(self, x: int, y: int):
+        if self._position != (x, y):
+            self.builder.pointer_action.move_to_location(x, y)
+            self._position = (x, y)
+
+    def _mouse(self, params: dict) -> bool:
+        pointer = self.builder.pointer_action
+        kind, button = params["type"], W3C_BUTTONS.get(params.get("button"))
+        if kind == "mouseMoved":
+            self._move_to(params["x"], params["y"])
+        elif kind == "mousePressed" and button is not None:
+            self._move_to(params["x"], params["y"])
+            pointer.pointer_down(button=button)
+        elif kind == "mouseReleased" and button is not None:
+            self._move_to(params["x"], params["y"])
+            pointer.pointer_up(button=button)
+        elif kind == "mouseWheel":
+            self.builder.wheel_action.scroll(params["x"], params["y"],
+                                             int(params["deltaX"]), int(params["deltaY"]))
+        else:
+            return False
+        return True
+
+    def _key(self, params: dict) -> bool:
+        key = W3C_KEYS.get(params["key"], params["key"])
+        if len(key) != 1:
+            return False
+        if params["type"] == "keyUp":
+            self.builder.key_action.key_up(key)
+        else:
+            self.builder.key_action.key_down(key)
+        return True
+
+    def _text(self, params: dict) -> bool:
+        for character in params["text"]:
+            self.builder.key_action.key_down(character).key_up(character)
+        return True
+
+    HANDLERS = {
+        "Input.dispatchMouseEvent": _mouse,
+        "Input.dispatchKeyEvent": _key,
+        "Input.insertText": _text,
+    }
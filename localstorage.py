@@ -2,45 +2,90 @@ from selenium.webdriver import Chrome
 
 
 class LocalStorage:
+    # Scripts below are written against localStorage; subclasses swap in another area.
+    area = "localStorage"
 
     def __init__(self, driver: Chrome):
         self.driver = driver
 
+    def _execute(self, script, *args):
+        if self.area != "localStorage":
+            script = script.replace("localStorage", self.area)
+        return self.driver.execute_script(script, *args)
+
     def __len__(self):
-        return self.driver.execute_script("return window.localStorage.length;")
+        return self._execute("return window.localStorage.length;")
 
     def items(self):
-        return self.driver.execute_script( \
+        return self._execute( \
             "var items = {}; " \
             "for (var i = 0, k; i < localStorage.length; ++i) " \
             "  items[k = localStorage.key(i)] = localStorage.getItem(k); " \
             "return items; ")
 
     def keys(self):
-        return self.driver.execute_script( \
+        return self._execute( \
             "var keys = []; " \
             "for (var i = 0; i < localStorage.length; ++i) " \
             "  keys[i] = localStorage.key(i); " \
             "return keys; ")
 
     def get(self, key):
-        return self.driver.execute_script(
+        return self._execute(
             "return localStorage.getItem(arguments[0]);", key)
 
     def set(self, key, value):
-        self.driver.execute_script(
+        self._execute(
             "localStorage.setItem(arguments[0], arguments[1]);", key,
             value)
 
     def has(self, key):
-        return key in self.keys()
+        return self._execute(
+            "return localStorage.getItem(arguments[0]) !== null;", key)
+
+    def get_many(self, keys):
+        """Values of several keys in one round-trip; missing keys map to None."""
+        return self._execute( \
+            "var items = {}; " \
+            "for (var i = 0; i < arguments[0].length; ++i) " \
+            "  items[arguments[0][i]] = localStorage.getItem(arguments[0][i]); " \
+            "return items; ", list(keys))
+
+    def update(self, mapping):
+        """Sets every key of `mapping` in one round-trip."""
+        if not mapping:
+            return
+        self._execute( \
+            "for (var k in arguments[0]) " \
+            "  if (Object.prototype.hasOwnProperty.call(arguments[0], k)) " \
+            "    localStorage.setItem(k, arguments[0][k]); ", dict(mapping))
+
+    def snapshot(self):
+        """All items, to compare against later with diff_since()."""
+        return self.items()
+
+    def diff_since(self, snapshot):
+        """What changed since `snapshot`, computed in the page in one round-trip.
+
+        Returns {"set": {key: value}, "removed": [key, ...]}; only changed
+        items are sent back.
+        """
+        return self._execute( \
+            "var old = arguments[0], changed = {}, removed = [], seen = {}; " \
+            "for (var i = 0, k, v; i < localStorage.length; ++i) { " \
+            "  k = localStorage.key(i); v = localStorage.getItem(k); seen[k] = true; " \
+            "  if (!Object.prototype.hasOwnProperty.call(old, k) || old[k] !== v) changed[k] = v; " \
+            "} " \
+            "for (var k in old) " \
+            "  if (Object.prototype.hasOwnProperty.call(old, k) && !seen[k]) removed.push(k); " \
+            "return {set: changed, removed: removed}; ", dict(snapshot))
 
     def remove(self, key):
-        self.driver.execute_script(
+        self._execute(
             "window.localStorage.removeItem(arguments[0]);", key)
 
     def clear(self):
-        self.driver.execute_script("window.localStorage.clear();")
+        self._execute("window.localStorage.clear();")
 
     def __getitem__(self, key):
         value = self.get(key)
@@ -52,10 +97,189 @@ class LocalStorage:
         self.set(key, value)
 
     def __contains__(self, key):
-        return key in self.keys()
+        return self.has(key)
 
     def __iter__(self):
         return self.items().__iter__()
 
     def __repr__(self):
         return self.items().__str__()
+
+
+class SessionStorage(LocalStorage):
+    area = "sessionStorage"
+
+
+# Tags values that JSON cannot carry (dates, binary data) so they survive the
+# trip through WebDriver and FileDB. Blobs, Maps and Sets are not preserved.
+IDB_CODEC = (
+    "function toB64(bytes) { "
+    "  var s = ''; "
+    "  for (var i = 0; i < bytes.length; i += 0x8000) "
+    "    s += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000)); "
+    "  return btoa(s); "
+    "} "
+    "function fromB64(text) { "
+    "  var s = atob(text), bytes = new Uint8Array(s.length); "
+    "  for (var i = 0; i < s.length; ++i) bytes[i] = s.charCodeAt(i); "
+    "  return bytes; "
+    "} "
+    "function encode(v) { "
+    "  if (v instanceof Date) return {__idb: 'Date', v: v.getTime()}; "
+    "  if (v instanceof ArrayBuffer) return {__idb: 'ArrayBuffer', v: toB64(new Uint8Array(v))}; "
+    "  if (ArrayBuffer.isView(v)) "
+    "    return {__idb: v.constructor.name, v: toB64(new Uint8Array(v.buffer, v.byteOffset, v.byteLength))}; "
+    "  if (Array.isArray(v)) return v.map(encode); "
+    "  if (v instanceof Blob) return null; "
+    "  if (v && typeof v === 'object') { "
+    "    var o = {}; "
+    "    for (var k in v) if (Object.prototype.hasOwnProperty.call(v, k)) o[k] = encode(v[k]); "
+    "    return o; "
+    "  } "
+    "  return v; "
+    "} "
+    "function decode(v) { "
+    "  if (Array.isArray(v)) return v.map(decode); "
+    "  if (v && typeof v === 'object') { "
+    "    if (v.__idb === 'Date') return new Date(v.v); "
+    "    if (v.__idb === 'ArrayBuffer') return fromB64(v.v).buffer; "
+    "    if (v.__idb) return new window[v.__idb](fromB64(v.v).buffer); "
+    "    var o = {}; "
+    "    for (var k in v) o[k] = decode(v[k]); "
+    "    return o; "
+    "  } "
+    "  return v; "
+    "} "
+)
+
+
+class IndexedDB:
+    """Dumps and restores the page's IndexedDB databases in chunks.
+
+    Every chunk is its own async script call, so a large database neither
+    holds the driver for long nor has to fit in a single response. Pass
+    `execute` to route those calls elsewhere, e.g. through a scheduler.
+    """
+
+    def __init__(self, driver: Chrome, chunk_size: int = 500, execute=None):
+        self.driver = driver
+        self.chunk_size = chunk_size
+        self._execute = execute or driver.execute_async_script
+
+    def _run(self, script, *args):
+        result = self._execute(script, *args)
+        if isinstance(result, dict) and result.get("error"):
+            raise RuntimeError(f"IndexedDB: {result['error']}")
+        return result
+
+    def schema(self):
+        """Databases of the current origin with their object stores and indexes."""
+        return self._run( \
+            "var done = arguments[arguments.length - 1]; " \
+            "if (!window.indexedDB || !indexedDB.databases) { done([]); return; } " \
+            "indexedDB.databases().then(function (infos) { " \
+            "  var result = [], pending = infos.length; " \
+            "  if (!pending) { done(result); return; } " \
+            "  infos.forEach(function (info) { " \
+            "    var req = indexedDB.open(info.name); " \
+            "    req.onerror = function () { if (--pending === 0) done(result); }; " \
+            "    req.onsuccess = function () { " \
+            "      var db = req.result, names = Array.prototype.slice.call(db.objectStoreNames), stores = []; " \
+            "      if (names.length) { " \
+            "        var tx = db.transaction(names, 'readonly'); " \
+            "        names.forEach(function (name) { " \
+            "          var store = tx.objectStore(name); " \
+            "          stores.push({name: name, keyPath: store.keyPath, autoIncrement: store.autoIncrement, " \
+            "            indexes: Array.prototype.map.call(store.indexNames, function (n) { " \
+            "              var index = store.index(n); " \
+            "              return {name: n, keyPath: index.keyPath, unique: index.unique, multiEntry: index.multiEntry}; " \
+            "            })}); " \
+            "        }); " \
+            "      } " \
+            "      result.push({name: db.name, version: db.version, stores: stores}); " \
+            "      db.close(); " \
+            "      if (--pending === 0) done(result); " \
+            "    }; " \
+            "  }); " \
+            "}, function () { done([]); }); ")
+
+    def read_chunk(self, database, store, after=None):
+        """Up to chunk_size records after primary key `after`, in key order."""
+        return self._run(IDB_CODEC + \
+            "var done = arguments[arguments.length - 1], limit = arguments[3]; " \
+            "var req = indexedDB.open(arguments[0]), storeName = arguments[1], after = arguments[2]; " \
+            "req.onerror = function () { done({error: String(req.error)}); }; " \
+            "req.onsuccess = function () { " \
+            "  var db = req.result, store = db.transaction(storeName, 'readonly').objectStore(storeName); " \
+            "  var range = after === null ? null : IDBKeyRange.lowerBound(decode(after), true); " \
+            "  var keys = store.getAllKeys(range, limit), values = store.getAll(range, limit); " \
+            "  values.onerror = function () { db.close(); done({error: String(values.error)}); }; " \
+            "  values.onsuccess = function () { " \
+            "    var records = keys.result.map(function (key, i) { return [encode(key), encode(values.result[i])]; }); " \
+            "    db.close(); " \
+            "    done({records: records, more: records.length === limit, " \
+            "          last: records.length ? records[records.length - 1][0] : null}); " \
+            "  }; " \
+            "}; ", database, store, after, self.chunk_size)
+
+    def dump(self):
+        """Yields (database, store, records) for every object store, one chunk at a time."""
+        for database in self.schema():
+            for store in database["stores"]:
+                after = None
+                while True:
+                    chunk = self.read_chunk(database["name"], store["name"], after)
+                    if chunk["records"]:
+                        yield database["name"], store["name"], chunk["records"]
+                    if not chunk["more"]:
+                        break
+                    after = chunk["last"]
+
+    def ensure_schema(self, database):
+        """Creates whatever stores and indexes of `database` are missing."""
+        return self._run( \
+            "var done = arguments[arguments.length - 1], schema = arguments[0]; " \
+            "var req = indexedDB.open(schema.name); " \
+            "req.onerror = function () { done({error: String(req.error)}); }; " \
+            "req.onsuccess = function () { " \
+            "  var db = req.result; " \
+            "  var missing = schema.stores.some(function (s) { return !db.objectStoreNames.contains(s.name); }); " \
+            "  var version = Math.max(db.version + 1, schema.version); " \
+            "  db.close(); " \
+            "  if (!missing) { done(true); return; } " \
+            "  var upgrade = indexedDB.open(schema.name, version); " \
+            "  upgrade.onupgradeneeded = function () { " \
+            "    var db = upgrade.result; " \
+            "    schema.stores.forEach(function (s) { " \
+            "      if (db.objectStoreNames.contains(s.name)) return; " \
+            "      var store = db.createObjectStore(s.name, {keyPath: s.keyPath, autoIncrement: s.autoIncrement}); " \
+            "      s.indexes.forEach(function (i) { " \
+            "        store.createIndex(i.name, i.keyPath, {unique: i.unique, multiEntry: i.multiEntry}); " \
+            "      }); " \
+            "    }); " \
+            "  }; " \
+            "  upgrade.onerror = function () { done({error: String(upgrade.error)}); }; " \
+            "  upgrade.onsuccess = function () { upgrade.result.close(); done(true); }; " \
+            "}; ", database)
+
+    def write_chunk(self, database, store, records):
+        return self._run(IDB_CODEC + \
+            "var done = arguments[arguments.length - 1], storeName = arguments[1], records = arguments[2]; " \
+            "var req = indexedDB.open(arguments[0]); " \
+            "req.onerror = function () { done({error: String(req.error)}); }; " \
+            "req.onsuccess = function () { " \
+            "  var db = req.result, tx = db.transaction(storeName, 'readwrite'), store = tx.objectStore(storeName); " \
+            "  records.forEach(function (record) { " \
+            "    if (store.keyPath !== null) store.put(decode(record[1])); " \
+            "    else store.put(decode(record[1]), decode(record[0])); " \
+            "  }); " \
+            "  tx.oncomplete = function () { db.close(); done(records.length); }; " \
+            "  tx.onabort = function () { db.close(); done({error: String(tx.error)}); }; " \
+            "}; ", database, store, records)
+
+    def restore(self, schema, chunks):
+        """Recreates the databases in `schema` and writes back dumped chunks."""
+        for database in schema:
+            self.ensure_schema(database)
+        for database, store, records in chunks:
+            self.write_chunk(database, store, records)
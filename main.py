@@ -7,7 +7,7 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException, InvalidArgumentException
 import json
 import os
-from time import sleep
+from time import sleep, time
 from threading import Thread, Event, local
 import base64
 from io import BytesIO
@@ -65,7 +65,7 @@ def start_browser():
         chrome_options.add_argument('--disable-dev-shm-usage')
         chrome_options.add_argument("start-maximized")
         current_uuid = str(uuid.uuid4())
-        user_data_dir = f"tmp/chrome_profile_1"
+        user_data_dir = f"/tmp/chrome_profile_{current_uuid}"
         chrome_options.add_argument(f"--user-data-dir={user_data_dir}")
 
         try:
@@ -88,8 +88,17 @@ def start_browser():
             browser_running = False
 
 
+def cookie_snapshot(cookies):
+    """Comparable view of a cookie list, without cookies that already expired."""
+    now = time()
+    return sorted(
+        (c.get("domain"), c.get("name"), c.get("path"), c.get("value"), c.get("expiry"))
+        for c in cookies if c.get("expiry") is None or c["expiry"] > now
+    )
+
 def keep_browser_alive():
     global browser_running
+    last_saved = cookie_snapshot(load_data(COOKIE_FILE))
     while browser_running:
         sleep(60)
         if not browser_running:
@@ -97,7 +106,12 @@ def keep_browser_alive():
         try:
             if hasattr(thread_local, 'driver') and thread_local.driver:
                 cookies = thread_local.driver.get_cookies()
-                save_data(COOKIE_FILE, cookies)
+                snapshot = cookie_snapshot(cookies)
+                # Only rewrite the file when a cookie actually changed.
+                if snapshot != last_saved:
+                    now = time()
+                    save_data(COOKIE_FILE, [c for c in cookies if c.get("expiry") is None or c["expiry"] > now])
+                    last_saved = snapshot
         except WebDriverException as e:
             print(f"WebDriverException in keep_browser_alive: {e}")
             browser_running = False
@@ -0,0 +1,169 @@
+import threading
+import uuid
+from collections import OrderedDict
+from time import monotonic
+
+# Job states; the last four are final.
+QUEUED = "queued"
+LOADING = "loading"
+INTERACTIVE = "interactive"
+COMPLETE = "complete"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINAL_STATES = (COMPLETE, FAILED, CANCELLED)
+
+# document.readyState values and DevTools lifecycle events, mapped to job states.
+READY_STATES = {"loading": LOADING, "interactive": INTERACTIVE, "complete": COMPLETE}
+LIFECYCLE_EVENTS = {"DOMContentLoaded": INTERACTIVE, "load": COMPLETE}
+
+
+class NavigationJob:
+    """One requested navigation, from queued until the page finished loading."""
+
+    def __init__(self, url: str):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.state = QUEUED
+        self.current_url = None
+        self.error = None
+        self.loader_id = None
+        self.future = None
+        self.created = monotonic()
+        # When the job last changed state.
+        self.updated = self.created
+        self.finished = None
+
+    @property
+    def done(self) -> bool:
+        return self.state in FINAL_STATES
+
+    def to_dict(self) -> dict:
+        end = self.finished if self.finished is not None else monotonic()
+        return {"id": self.id, "url": self.url, "state": self.state,
+                "current_url": self.current_url, "error": self.error,
+                "elapsed_ms": round((end - self.created) * 1000, 1)}
+
+
+class NavigationTracker:
+    """Keeps a session's recent navigation jobs and moves them through their states.
+
+    Only the newest job is live: starting another one cancels it. Progress
+    comes from DevTools lifecycle events where available, otherwise from
+    whoever polls document.readyState. Events are matched to jobs by loader
+    id, and may arrive before the job learns its loader id.
+    """
+
+    def __init__(self, timeout: float, history: int = 20):
+        self.timeout = timeout
+        self.history = history
+        self._jobs = OrderedDict()
+        self._current = None
+        # loader id -> [state, url] of recent main frame loads seen in page events.
+        self._loaders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, url: str):
+        """Registers a new job; returns it along with the job it superseded, if any."""
+        job = NavigationJob(url)
+        with self._lock:
+            superseded = self._current if self._current and not self._current.done else None
+            if superseded:
+                self._finish(superseded, CANCELLED, "Superseded by a newer navigation")
+            self._current = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+        return job, superseded
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job.state in (LOADING, INTERACTIVE) and monotonic() - job.created > self.timeout:
+                self._finish(job, FAILED, "Timed out")
+            return job
+
+    def current(self):
+        with self._lock:
+            return self._current
+
+    def starting(self, job: NavigationJob) -> bool:
+        """Returns False if the job was cancelled before the driver got to it."""
+        with self._lock:
+            return not job.done
+
+    def started(self, job: NavigationJob, loader_id: str = None, current_url: str = None):
+        """Marks a committed job as loading, catching up on events already seen.
+
+        Navigations without a loader id stayed within the document and are
+        complete right away.
+        """
+        with self._lock:
+            if job.done:
+                return
+            job.state = LOADING
+            job.updated = monotonic()
+            job.loader_id = loader_id
+            job.current_url = current_url
+            if loader_id is None:
+                self._finish(job, COMPLETE)
+            elif loader_id in self._loaders:
+                self._advance(job, *self._loaders[loader_id])
+
+    def update(self, job: NavigationJob, state: str, current_url: str = None):
+        """Advances a job that is loading; states never go backwards and final ones stick."""
+        with self._lock:
+            self._advance(job, state, current_url)
+
+    def fail(self, job: NavigationJob, error: str):
+        with self._lock:
+            if not job.done:
+                self._finish(job, FAILED, error)
+
+    def cancel(self, job: NavigationJob) -> bool:
+        """Cancels a job; returns True if it had already started loading."""
+        with self._lock:
+            if job.done:
+                return False
+            was_loading = job.state != QUEUED
+            self._finish(job, CANCELLED)
+            return was_loading
+
+    def on_page_event(self, method: str, params: dict):
+        """Feeds DevTools Page.frameNavigated and Page.lifecycleEvent into the jobs."""
+        if method == "Page.frameNavigated":
+            frame = params.get("frame", {})
+            if frame.get("parentId"):
+                return
+            loader_id, state, url = frame.get("loaderId"), LOADING, frame.get("url")
+        elif method == "Page.lifecycleEvent" and params.get("name") in LIFECYCLE_EVENTS:
+            loader_id, state, url = params.get("loaderId"), LIFECYCLE_EVENTS[params["name"]], None
+        else:
+            return
+        with self._lock:
+            seen = self._loaders.setdefault(loader_id, [LOADING, None])
+            if state != LOADING:
+                seen[0] = state
+            seen[1] = url or seen[1]
+            while len(self._loaders) > self.history:
+                self._loaders.popitem(last=False)
+            job = self._current
+            if job is not None and job.loader_id == loader_id:
+                self._advance(job, *seen)
+
+    def _advance(self, job: NavigationJob, state: str, current_url: str = None):
+        if job.done or job.state == QUEUED:
+            return
+        if current_url:
+            job.current_url = current_url
+        if state == COMPLETE:
+            self._finish(job, COMPLETE)
+        elif state == INTERACTIVE and job.state != INTERACTIVE:
+            job.state = INTERACTIVE
+            job.updated = monotonic()
+
+    def _finish(self, job: NavigationJob, state: str, error: str = None):
+        job.state = state
+        job.error = error
+        job.finished = job.updated = monotonic()
+        if job.future is not None:
+            job.future.cancel()
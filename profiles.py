@@ -0,0 +1,218 @@
+import fcntl
+import json
+import os
+import shutil
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+from time import time
+
+# Files Chrome leaves behind when it dies without a clean shutdown; while
+# they exist a new Chrome refuses to open the profile.
+SINGLETON_FILES = ("SingletonLock", "SingletonSocket", "SingletonCookie")
+
+
+def pid_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def chrome_running_in(path: str) -> bool:
+    """Whether a live Chrome holds the profile at `path`.
+
+    Chrome's SingletonLock is a symlink to "<hostname>-<pid>". A lock
+    taken on another host is assumed to be live, since we cannot check it.
+    """
+    try:
+        target = os.readlink(os.path.join(path, "SingletonLock"))
+    except OSError:
+        return False
+    hostname, _, pid = target.rpartition("-")
+    if hostname != socket.gethostname() or not pid.isdigit():
+        return True
+    return pid_running(int(pid))
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class ProfileManager:
+    """Persistent Chrome user-data-dirs, one per session, kept under a disk budget.
+
+    Profiles live under `root` and are recorded in an index mapping session
+    ids to directories with their last use. A session keeps its profile,
+    and with it Chrome's HTTP cache, across restarts. Profiles not in use
+    are evicted least recently used first once all of them together take
+    more than `max_bytes`.
+
+    Several processes may share `root`: the index is re-read and written
+    under a file lock, and no sweep touches a profile a live Chrome holds,
+    or a spare profile whose creating process is still running elsewhere.
+    """
+
+    def __init__(self, root: str, max_bytes: int, cache_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.cache_bytes = cache_bytes
+        self._index_filename = os.path.join(root, "index.json")
+        self._lock_filename = os.path.join(root, "index.lock")
+        self._lock = threading.Lock()
+        self._in_use = set()
+        # path -> (bytes, time measured) as of the last evict()
+        self._sizes = {}
+        os.makedirs(root, exist_ok=True)
+        self._index = self._load_index()
+
+    @contextmanager
+    def _shared_index(self):
+        """Locks the index against other threads and processes and re-reads it."""
+        with self._lock, open(self._lock_filename, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._index = self._load_index()
+                yield self._index
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self._index_filename, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self):
+        tmp_filename = f"{self._index_filename}.tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(tmp_filename, self._index_filename)
+
+    def chrome_arguments(self, path: str) -> list:
+        return [f"--user-data-dir={os.path.abspath(path)}", f"--disk-cache-size={self.cache_bytes}"]
+
+    def new_profile(self) -> str:
+        """Creates an empty profile directory that no session owns yet.
+
+        The name starts with our pid, so sweeps can tell whose spare it is.
+        """
+        path = os.path.join(self.root, f"{os.getpid()}-{uuid.uuid4().hex}")
+        os.makedirs(path)
+        with self._lock:
+            self._in_use.add(path)
+        return path
+
+    def assigned(self, session_id: str):
+        """The profile directory a session used before, if it still exists."""
+        with self._shared_index() as index:
+            entry = index.get(session_id)
+        if entry and os.path.isdir(entry["path"]):
+            return entry["path"]
+        return None
+
+    def acquire(self, session_id: str, path: str = None) -> str:
+        """Claims a session's profile, adopting `path` if it has none yet."""
+        path = self.assigned(session_id) or path or self.new_profile()
+        if not chrome_running_in(path):
+            for name in SINGLETON_FILES:
+                try:
+                    os.remove(os.path.join(path, name))
+                except OSError:
+                    pass
+        with self._shared_index() as index:
+            self._in_use.add(path)
+            index[session_id] = {"path": path, "last_used": time()}
+            self._save_index()
+        return path
+
+    def release(self, path: str):
+        """Marks a profile unused once its Chrome has quit."""
+        with self._shared_index() as index:
+            self._in_use.discard(path)
+            for entry in index.values():
+                if entry["path"] == path:
+                    entry["last_used"] = time()
+            self._save_index()
+
+    def _orphaned(self, name: str) -> bool:
+        """Whether a spare profile's creator is gone, or is us and no longer uses it."""
+        creator, _, _ = name.partition("-")
+        if not creator.isdigit():
+            return True  # named before spares carried their creator's pid
+        if int(creator) == os.getpid():
+            return os.path.join(self.root, name) not in self._in_use
+        return not pid_running(int(creator))
+
+    def cleanup(self):
+        """Removes profile directories no session owns and nobody uses, e.g. leftover spares."""
+        with self._shared_index() as index:
+            owned = {entry["path"] for entry in index.values()}
+            spares = [os.path.join(self.root, name) for name in os.listdir(self.root)
+                      if self._orphaned(name)]
+        for path in spares:
+            if os.path.isdir(path) and path not in owned and not chrome_running_in(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _measure(self, entry: dict, in_use: set) -> int:
+        """Size of a profile, walked again only if it may have changed since last time."""
+        path = entry["path"]
+        with self._lock:
+            size, measured = self._sizes.get(path, (None, 0))
+        if size is None or entry["last_used"] >= measured or path in in_use \
+                or chrome_running_in(path):
+            measured = time()
+            size = directory_size(path)
+        with self._lock:
+            self._sizes[path] = (size, measured)
+        return size
+
+    def evict(self) -> list:
+        """Deletes unused profiles, least recently used first, until under max_bytes."""
+        self.cleanup()
+        with self._shared_index() as index:
+            entries = sorted(index.items(), key=lambda item: item[1]["last_used"])
+            in_use = set(self._in_use)
+        sizes = {entry["path"]: self._measure(entry, in_use) for _, entry in entries}
+        with self._lock:
+            self._sizes = {path: self._sizes[path] for path in sizes}
+        total = sum(sizes.values())
+        evicted = []
+        for session_id, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry["path"] in in_use or chrome_running_in(entry["path"]):
+                continue
+            shutil.rmtree(entry["path"], ignore_errors=True)
+            total -= sizes[entry["path"]]
+            with self._lock:
+                self._sizes.pop(entry["path"], None)
+            evicted.append(session_id)
+        if evicted:
+            with self._shared_index() as index:
+                for session_id in evicted:
+                    index.pop(session_id, None)
+                self._save_index()
+            print(f"Evicted Chrome profiles of {', '.join(evicted)}.")
+        return evicted
+
+    def usage(self) -> dict:
+        """Profile counts and disk use, as measured by the last evict()."""
+        with self._lock:
+            paths = [entry["path"] for entry in self._index.values()]
+            in_use = len(self._in_use)
+            used = sum(self._sizes[path][0] for path in paths if path in self._sizes)
+        return {"profiles": len(paths), "in_use": in_use, "bytes": used,
+                "max_bytes": self.max_bytes}
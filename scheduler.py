@@ -0,0 +1,98 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+from time import monotonic
+
+# Lower runs first. User input always jumps ahead of queued frame captures.
+PRIORITY_INPUT = 0
+PRIORITY_NAVIGATE = 1
+PRIORITY_CAPTURE = 2
+PRIORITY_MAINTENANCE = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_INPUT: "input",
+    PRIORITY_NAVIGATE: "navigate",
+    PRIORITY_CAPTURE: "capture",
+    PRIORITY_MAINTENANCE: "maintenance",
+}
+
+
+class DriverScheduler:
+    """Runs every WebDriver call on a single thread, highest priority first.
+
+    WebDriver talks to chromedriver over one HTTP connection and cannot run
+    commands concurrently, so instead of several locks each caller queues
+    its work here. A running command is never interrupted; priorities only
+    decide what runs next.
+    """
+
+    def __init__(self, name: str = "driver-scheduler"):
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._stopped = False
+        self._stats_lock = threading.Lock()
+        self._stats = {priority: {"count": 0, "wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0}
+                       for priority in PRIORITY_NAMES}
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, priority: int = PRIORITY_MAINTENANCE, **kwargs) -> Future:
+        if self._stopped:
+            raise RuntimeError("Driver scheduler stopped")
+        future = Future()
+        self._queue.put((priority, next(self._counter), monotonic(), future, fn, args, kwargs))
+        return future
+
+    def call(self, fn, *args, priority: int = PRIORITY_MAINTENANCE, timeout: float = None, **kwargs):
+        """Queues `fn` and blocks until it has run, re-raising whatever it raised."""
+        if threading.current_thread() is self._thread:
+            # Already on the driver thread, queueing would deadlock.
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, priority=priority, **kwargs).result(timeout)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            priority, _, queued_at, future, fn, args, kwargs = self._queue.get()
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = monotonic()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self._record(priority, started - queued_at, monotonic() - started)
+
+    def _record(self, priority: int, waited: float, ran: float):
+        with self._stats_lock:
+            stats = self._stats.setdefault(
+                priority, {"count": 0, "wait_total": 0.0, "wait_max": 0.0, "run_total": 0.0})
+            stats["count"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+            stats["run_total"] += ran
+
+    def metrics(self) -> dict:
+        """Queue wait and run times per priority, in milliseconds."""
+        with self._stats_lock:
+            result = {"pending": self.pending()}
+            for priority, stats in self._stats.items():
+                count = stats["count"]
+                result[PRIORITY_NAMES.get(priority, str(priority))] = {
+                    "count": count,
+                    "wait_avg_ms": round(stats["wait_total"] / count * 1000, 2) if count else 0.0,
+                    "wait_max_ms": round(stats["wait_max"] * 1000, 2),
+                    "run_avg_ms": round(stats["run_total"] / count * 1000, 2) if count else 0.0,
+                }
+            return result
+
+    def stop(self):
+        """Lets already queued work finish, then ends the driver thread."""
+        self._stopped = True
+        self._queue.put((PRIORITY_MAINTENANCE + 1, next(self._counter), monotonic(), None, None, (), {}))
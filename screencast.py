@@ -0,0 +1,127 @@
+import base64
+import itertools
+import json
+import queue
+import threading
+from urllib.request import urlopen
+
+import websocket  # websocket-client, installed along with selenium
+from selenium.webdriver import Chrome
+
+
+class Screencast:
+    """Receives frames pushed by Chrome via the DevTools Page.startScreencast command.
+
+    Chrome only sends a frame when the page repaints and waits for an ack
+    before sending the next one, so `on_frame(data, metadata)` naturally
+    throttles capture. It runs on a thread of its own and the ack goes out
+    when it returns, so it may block without holding up the connection.
+    Other Page events on the same connection go to `on_event(method, params)`
+    as they arrive.
+    """
+
+    def __init__(self, driver: Chrome, on_frame, format: str = "jpeg", quality: int = 80,
+                 max_width: int = None, max_height: int = None, on_event=None):
+        self.driver = driver
+        self.on_frame = on_frame
+        self.on_event = on_event
+        self.params = {"format": format, "quality": quality, "everyNthFrame": 1}
+        if max_width:
+            self.params["maxWidth"] = max_width
+        if max_height:
+            self.params["maxHeight"] = max_height
+        self._ids = itertools.count(1)
+        self._ws = None
+        self._thread = None
+        # Frames waiting for on_frame; Chrome sends the next only after the ack.
+        self._frames = queue.Queue()
+        self._stopped = threading.Event()
+
+    def _page_websocket_url(self) -> str:
+        address = self.driver.capabilities["goog:chromeOptions"]["debuggerAddress"]
+        with urlopen(f"http://{address}/json", timeout=5) as response:
+            targets = json.load(response)
+        pages = [target for target in targets if target.get("type") == "page"]
+        # chromedriver uses DevTools target ids as window handles.
+        handle = self.driver.current_window_handle
+        for target in pages:
+            if target.get("id") == handle:
+                return target["webSocketDebuggerUrl"]
+        if not pages:
+            raise RuntimeError("No page target to screencast")
+        return pages[0]["webSocketDebuggerUrl"]
+
+    def _send(self, method: str, params: dict = None):
+        self._ws.send(json.dumps({"id": next(self._ids), "method": method, "params": params or {}}))
+
+    @property
+    def running(self) -> bool:
+        return self._ws is not None and not self._stopped.is_set()
+
+    def send(self, commands: list):
+        """Sends (method, params) commands to the page without waiting for their results.
+
+        They go out in order on the screencast's connection, skipping the
+        trip through chromedriver; failures are only logged.
+        """
+        for method, params in commands:
+            self._send(method, params)
+
+    def start(self):
+        self._ws = websocket.create_connection(self._page_websocket_url(), timeout=10,
+                                               suppress_origin=True)
+        self._ws.settimeout(None)
+        self._send("Page.enable")
+        if self.on_event:
+            self._send("Page.setLifecycleEventsEnabled", {"enabled": True})
+        self._send("Page.startScreencast", self.params)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._deliver_frames, daemon=True).start()
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                message = json.loads(self._ws.recv())
+                if "error" in message:
+                    print(f"DevTools command {message.get('id')} failed: {message['error']}")
+                if message.get("method") != "Page.screencastFrame":
+                    if self.on_event and "method" in message:
+                        self.on_event(message["method"], message.get("params", {}))
+                    continue
+                self._frames.put(message["params"])
+        except Exception as e:
+            if not self._stopped.is_set():
+                print(f"Screencast connection lost: {e}")
+        finally:
+            self._stopped.set()
+            self._frames.put(None)
+
+    def _deliver_frames(self):
+        while True:
+            params = self._frames.get()
+            if params is None or self._stopped.is_set():
+                return
+            try:
+                self.on_frame(base64.b64decode(params["data"]), params.get("metadata", {}))
+            except Exception as e:
+                print(f"Error handling screencast frame: {e}")
+            try:
+                self._send("Page.screencastFrameAck", {"sessionId": params["sessionId"]})
+            except Exception:
+                return  # connection lost, _run notices too
+
+    def wait(self, timeout: float = None) -> bool:
+        """Blocks until the screencast stops; returns False on timeout."""
+        return self._stopped.wait(timeout)
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._frames.put(None)
+        try:
+            self._send("Page.stopScreencast")
+            self._ws.close()
+        except Exception:
+            pass
@@ -0,0 +1,32 @@
+"""Production launcher: serves asgi.py with uvicorn instead of Flask's debug server.
+
+    python serve.py --bind 0.0.0.0:8080
+
+Runs a single worker: each process would start its own warm pool, reaper
+and profile sweeps and write the same db.json, so several of them on one
+machine step on each other's browsers and saved state.
+"""
+import argparse
+
+import uvicorn
+
+BIND = "0.0.0.0:8080"
+WORKERS = 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the remote browser over ASGI.")
+    parser.add_argument('--bind', default=BIND, help="host:port to listen on")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="worker processes; only 1 is supported")
+    args = parser.parse_args()
+    if args.workers != 1:
+        parser.error("only one worker is supported: workers would share profiles and db.json")
+    host, _, port = args.bind.rpartition(':')
+    # uvicorn imports the app itself, so --help or bad arguments never start a browser.
+    uvicorn.run('asgi:app', host=host or '0.0.0.0', port=int(port), workers=args.workers,
+                proxy_headers=True, log_level='info')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import os
+import threading
+from time import monotonic, sleep
+
+import psutil
+
+
+class SessionLimitError(Exception):
+    """Raised when a new session would exceed the configured pool size."""
+
+
+class SessionManager:
+    """Keeps one browser session per session id, up to `max_sessions` at a time.
+
+    `factory(session_id)` builds and starts a session; sessions must provide
+    a `close()` method that releases the browser.
+    """
+
+    def __init__(self, factory, max_sessions: int):
+        self._factory = factory
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, create: bool = True):
+        """Returns the session for `session_id`, creating it if allowed."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None and create:
+                if len(self._sessions) >= self.max_sessions:
+                    raise SessionLimitError(
+                        f"All {self.max_sessions} browser sessions are in use")
+                session = self._factory(session_id)
+                self._sessions[session_id] = session
+            return session
+
+    def close(self, session_id: str) -> bool:
+        """Closes and forgets a session; returns False if there was none."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.close()
+        return True
+
+    def sessions(self) -> dict:
+        with self._lock:
+            return dict(self._sessions)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class WarmPool:
+    """Keeps `size` launched, blank browsers ready so new sessions skip Chrome's cold start.
+
+    `launch()` starts one browser. Handing one out triggers a refill in the
+    background; if the pool is empty the caller launches one itself.
+    """
+
+    def __init__(self, launch, size: int):
+        self._launch = launch
+        self.size = size
+        self._ready = []
+        self._lock = threading.Lock()
+        self._refill = threading.Event()
+        self._closed = False
+        self._stats = {"hits": 0, "misses": 0, "launches": 0, "launch_failures": 0,
+                       "launch_total": 0.0, "launch_max": 0.0}
+        self._thread = threading.Thread(target=self._fill, name="warm-pool", daemon=True)
+
+    def start(self):
+        if self.size > 0:
+            self._thread.start()
+            self._refill.set()
+        return self
+
+    def acquire(self):
+        """Returns a ready browser, launching one on the spot if none is warm."""
+        with self._lock:
+            driver = self._ready.pop(0) if self._ready else None
+            self._stats["hits" if driver else "misses"] += 1
+        self._refill.set()
+        return driver or self._timed_launch()
+
+    def _timed_launch(self):
+        started = monotonic()
+        try:
+            driver = self._launch()
+        except Exception:
+            with self._lock:
+                self._stats["launch_failures"] += 1
+            raise
+        elapsed = monotonic() - started
+        with self._lock:
+            self._stats["launches"] += 1
+            self._stats["launch_total"] += elapsed
+            self._stats["launch_max"] = max(self._stats["launch_max"], elapsed)
+        return driver
+
+    def _fill(self):
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while not self._closed:
+                with self._lock:
+                    if len(self._ready) >= self.size:
+                        break
+                try:
+                    driver = self._timed_launch()
+                except Exception as e:
+                    print(f"Error launching warm browser: {e}")
+                    sleep(5)
+                    continue
+                with self._lock:
+                    if not self._closed:
+                        self._ready.append(driver)
+                        driver = None
+                if driver:
+                    driver.quit()
+            if self._closed:
+                break
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            ready = len(self._ready)
+        launches = stats.pop("launches")
+        total = stats.pop("launch_total")
+        requests = stats["hits"] + stats["misses"]
+        stats.update({
+            "ready": ready,
+            "size": self.size,
+            "launches": launches,
+            "hit_rate": round(stats["hits"] / requests, 3) if requests else 0.0,
+            "launch_avg_ms": round(total / launches * 1000, 1) if launches else 0.0,
+            "launch_max_ms": round(stats.pop("launch_max") * 1000, 1),
+        })
+        return stats
+
+    def close(self):
+        """Quits every browser still waiting in the pool."""
+        with self._lock:
+            self._closed = True
+            ready, self._ready = self._ready, []
+        self._refill.set()
+        for driver in ready:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
+def process_tree_rss() -> int:
+    """Resident memory of this process and everything it started (chromedriver, Chrome)."""
+    process = psutil.Process(os.getpid())
+    total = 0
+    for proc in [process] + process.children(recursive=True):
+        try:
+            total += proc.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            pass
+    return total
+
+
+class SessionReaper:
+    """Closes sessions nobody used for `ttl` seconds, and the least recently
+    used ones while our browsers take more than `max_rss` bytes.
+
+    Sessions must provide `idle_for()` and `viewers`; closing them goes
+    through the manager so their cookies and LocalStorage get saved.
+    `on_sweep()`, if given, runs after every pass for further cleanup.
+    """
+
+    def __init__(self, manager: SessionManager, ttl: float, max_rss: int, interval: float,
+                 on_sweep=None):
+        self.manager = manager
+        self.ttl = ttl
+        self.max_rss = max_rss
+        self.interval = interval
+        self.on_sweep = on_sweep
+        self.reaped = {"idle": 0, "memory": 0}
+        self._thread = threading.Thread(target=self._run, name="session-reaper", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            sleep(self.interval)
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Error in session reaper: {e}")
+
+    def _close(self, session_id: str, reason: str):
+        print(f"Reaping session {session_id} ({reason}).")
+        if self.manager.close(session_id):
+            self.reaped[reason] += 1
+
+    def reap(self):
+        for session_id, session in self.manager.sessions().items():
+            if session.idle_for() > self.ttl:
+                self._close(session_id, "idle")
+
+        while self.max_rss and process_tree_rss() > self.max_rss:
+            sessions = self.manager.sessions()
+            if not sessions:
+                break
+            # Unwatched sessions go first, then the longest idle one.
+            session_id = max(sessions, key=lambda key: (not sessions[key].viewers,
+                                                        sessions[key].idle_for()))
+            self._close(session_id, "memory")
+
+        if self.on_sweep:
+            self.on_sweep()
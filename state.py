@@ -0,0 +1,263 @@
+import json
+from contextlib import contextmanager
+from time import time
+from urllib.parse import urlparse
+
+from filedb import FileDB
+
+COOKIE_PREFIX = "cookie:"
+LOCALSTORAGE_PREFIX = "ls:"
+SESSIONSTORAGE_PREFIX = "ss:"
+INDEXEDDB_PREFIX = "idb:"
+# A saved cookie is rewritten only when one of these changed.
+COOKIE_FIELDS = ("domain", "name", "path", "value", "expiry")
+
+
+def origin_of(url: str) -> str:
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def cookie_key(cookie: dict) -> str:
+    return COOKIE_PREFIX + json.dumps([cookie["domain"], cookie.get("path", "/"), cookie["name"]])
+
+
+def cookie_fingerprint(cookie: dict) -> tuple:
+    return tuple(cookie.get(field) for field in COOKIE_FIELDS)
+
+
+def is_expired(cookie: dict, now: float) -> bool:
+    expiry = cookie.get("expiry")
+    return expiry is not None and expiry <= now
+
+
+def is_legacy_cookie(value) -> bool:
+    return isinstance(value, dict) and "domain" in value and "name" in value
+
+
+def storage_key(prefix: str, origin: str, key: str) -> str:
+    return prefix + json.dumps([origin, key])
+
+
+def localstorage_key(origin: str, key: str) -> str:
+    return storage_key(LOCALSTORAGE_PREFIX, origin, key)
+
+
+def indexeddb_key(origin: str, chunk: int = None) -> str:
+    """Key of an origin's IndexedDB schema, or of one of its record chunks."""
+    return INDEXEDDB_PREFIX + json.dumps([origin] if chunk is None else [origin, chunk])
+
+
+class StateStore:
+    """Browser state kept in a FileDB under separate namespaces.
+
+    Cookies are stored one entry per (domain, path, name), LocalStorage and
+    sessionStorage one entry per (origin, key). In-memory indexes by domain
+    and by origin mean a lookup or restore only touches the entries it
+    needs. IndexedDB dumps are kept per origin as a schema entry plus
+    numbered chunks of records.
+    """
+
+    def __init__(self, db: FileDB, legacy_origin: str = None):
+        self.db = db
+        self._migrate(legacy_origin)
+        self._reindex()
+
+    def _reindex(self):
+        self._cookies = {}  # domain -> set of keys
+        # prefix -> origin -> {storage key: db key}
+        self._storage = {LOCALSTORAGE_PREFIX: {}, SESSIONSTORAGE_PREFIX: {}}
+        for key, value in self.db.items():
+            self._index(key, value)
+
+    @contextmanager
+    def _batch(self):
+        """A FileDB batch whose rollback also rolls back the indexes."""
+        try:
+            with self.db.batch():
+                yield
+        except BaseException:
+            self._reindex()
+            raise
+
+    def _migrate(self, legacy_origin: str):
+        """Moves entries from the old flat layout, where cookies were stored
+        under numeric keys and LocalStorage of SINGLE_PAGE under plain ones.
+
+        LocalStorage keys could be numeric too, so only numeric entries that
+        look like cookies are taken for one.
+        """
+        legacy = [key for key in self.db if (key.isnumeric() and is_legacy_cookie(self.db[key]))
+                  or (legacy_origin and (key.isalpha() or key.isnumeric()))]
+        if not legacy:
+            return
+        with self.db.batch():
+            for key in legacy:
+                value = self.db.pop(key)
+                if key.isnumeric() and is_legacy_cookie(value):
+                    self.db[cookie_key(value)] = value
+                else:
+                    self.db[localstorage_key(legacy_origin, key)] = {
+                        "origin": legacy_origin, "key": key, "value": value}
+        print(f"Migrated {len(legacy)} entries in {self.db.filename}.")
+
+    def _index(self, key: str, value):
+        if key.startswith(COOKIE_PREFIX):
+            self._cookies.setdefault(value["domain"], set()).add(key)
+        elif key[:3] in self._storage:
+            self._storage[key[:3]].setdefault(value["origin"], {})[value["key"]] = key
+
+    def _unindex(self, key: str, value):
+        if key.startswith(COOKIE_PREFIX):
+            keys = self._cookies.get(value["domain"], set())
+            keys.discard(key)
+            if not keys:
+                self._cookies.pop(value["domain"], None)
+        elif key[:3] in self._storage:
+            origins = self._storage[key[:3]]
+            keys = origins.get(value["origin"], {})
+            keys.pop(value["key"], None)
+            if not keys:
+                origins.pop(value["origin"], None)
+
+    # --- Cookies ---
+
+    def has_cookies(self) -> bool:
+        return bool(self._cookies)
+
+    def cookie_domains(self) -> list:
+        return list(self._cookies)
+
+    def cookies(self, domain: str = None) -> list:
+        """Saved cookies, either all of them or those set for one domain."""
+        domains = [domain] if domain is not None else list(self._cookies)
+        return [self.db[key] for name in domains for key in self._cookies.get(name, ())]
+
+    def put_cookie(self, cookie: dict) -> None:
+        key = cookie_key(cookie)
+        if self.db.get(key) != cookie:
+            self.db[key] = cookie
+            self._index(key, cookie)
+
+    def delete_cookie(self, cookie: dict) -> None:
+        key = cookie_key(cookie)
+        if key in self.db:
+            self._unindex(key, self.db.pop(key))
+
+    def sync_cookies(self, cookies: list, now: float = None) -> dict:
+        """Makes the saved cookies match the browser's, writing only what differs.
+
+        Cookies are compared on COOKIE_FIELDS against what was saved last
+        time; expired ones are dropped instead of saved. Returns how many
+        cookies were inserted, updated, deleted and pruned.
+        """
+        now = time() if now is None else now
+        live = {cookie_key(cookie): cookie for cookie in cookies if not is_expired(cookie, now)}
+        changes = {"inserted": 0, "updated": 0, "deleted": 0, "pruned": 0}
+        with self._batch():
+            for cookie in self.cookies():
+                if cookie_key(cookie) not in live:
+                    self.delete_cookie(cookie)
+                    changes["pruned" if is_expired(cookie, now) else "deleted"] += 1
+            for key, cookie in live.items():
+                saved = self.db.get(key)
+                if saved is None:
+                    changes["inserted"] += 1
+                elif cookie_fingerprint(saved) != cookie_fingerprint(cookie):
+                    changes["updated"] += 1
+                else:
+                    continue
+                self.db[key] = cookie
+                self._index(key, cookie)
+        return changes
+
+    # --- LocalStorage and sessionStorage ---
+
+    def _has_storage(self, prefix: str, origin: str = None) -> bool:
+        if origin is None:
+            return bool(self._storage[prefix])
+        return origin in self._storage[prefix]
+
+    def _storage_items(self, prefix: str, origin: str) -> dict:
+        return {name: self.db[key]["value"]
+                for name, key in self._storage[prefix].get(origin, {}).items()}
+
+    def _put_storage(self, prefix: str, origin: str, items: dict, replace: bool) -> None:
+        with self._batch():
+            if replace:
+                for name, key in list(self._storage[prefix].get(origin, {}).items()):
+                    if name not in items:
+                        self._unindex(key, self.db.pop(key))
+            for name, value in items.items():
+                key = storage_key(prefix, origin, name)
+                entry = {"origin": origin, "key": name, "value": value}
+                if self.db.get(key) != entry:
+                    self.db[key] = entry
+                    self._index(key, entry)
+
+    def has_localstorage(self, origin: str = None) -> bool:
+        return self._has_storage(LOCALSTORAGE_PREFIX, origin)
+
+    def origins(self) -> list:
+        return list(self._storage[LOCALSTORAGE_PREFIX])
+
+    def localstorage(self, origin: str) -> dict:
+        """Saved LocalStorage items of one origin."""
+        return self._storage_items(LOCALSTORAGE_PREFIX, origin)
+
+    def put_localstorage(self, origin: str, items: dict, replace: bool = False) -> None:
+        """Saves LocalStorage items of an origin; `replace` drops keys not in `items`."""
+        self._put_storage(LOCALSTORAGE_PREFIX, origin, items, replace)
+
+    def has_sessionstorage(self, origin: str = None) -> bool:
+        return self._has_storage(SESSIONSTORAGE_PREFIX, origin)
+
+    def sessionstorage(self, origin: str) -> dict:
+        return self._storage_items(SESSIONSTORAGE_PREFIX, origin)
+
+    def put_sessionstorage(self, origin: str, items: dict, replace: bool = False) -> None:
+        self._put_storage(SESSIONSTORAGE_PREFIX, origin, items, replace)
+
+    # --- IndexedDB ---
+
+    def has_indexeddb(self, origin: str) -> bool:
+        return indexeddb_key(origin) in self.db
+
+    def put_indexeddb(self, origin: str, schema: list, chunks) -> int:
+        """Saves an IndexedDB dump of an origin as `chunks` arrive; returns their number.
+
+        The schema entry is written last, so an interrupted dump leaves no
+        snapshot rather than a mix of old and new chunks. Chunks beyond the
+        new dump's are found by key rather than from the old schema entry,
+        which an interrupted dump no longer has.
+        """
+        self.db.pop(indexeddb_key(origin), None)
+        count = 0
+        for database, store, records in chunks:
+            self.db[indexeddb_key(origin, count)] = {
+                "origin": origin, "database": database, "store": store, "records": records}
+            count += 1
+        with self.db.batch():
+            for stale in self._indexeddb_chunks(origin):
+                if stale >= count:
+                    self.db.pop(indexeddb_key(origin, stale), None)
+            self.db[indexeddb_key(origin)] = {"origin": origin, "schema": schema, "chunks": count}
+        return count
+
+    def _indexeddb_chunks(self, origin: str) -> list:
+        """Numbers of the chunks stored for an origin."""
+        prefix = indexeddb_key(origin)[:-1] + ", "
+        return [json.loads(key[len(INDEXEDDB_PREFIX):])[1] for key in list(self.db)
+                if key.startswith(prefix)]
+
+    def indexeddb(self, origin: str):
+        """Returns (schema, chunks) of an origin's saved dump, or None.
+
+        Chunks are read from the store one at a time while being iterated.
+        """
+        saved = self.db.get(indexeddb_key(origin))
+        if saved is None:
+            return None
+        chunks = ((chunk["database"], chunk["store"], chunk["records"])
+                  for chunk in (self.db[indexeddb_key(origin, i)] for i in range(saved["chunks"])))
+        return saved["schema"], chunks
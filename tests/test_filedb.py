@@ -0,0 +1,69 @@
+import pytest
+
+import filedb
+from filedb import FileDB, JSONBackend, LogBackend
+
+
+@pytest.fixture
+def db(tmp_path):
+    return FileDB(backend=JSONBackend(str(tmp_path / "db.json")))
+
+
+def test_batch_rollback_restores_changed_keys(db):
+    db.update({"kept": 1, "changed": 2, "deleted": 3})
+    with pytest.raises(RuntimeError):
+        with db.batch():
+            db["changed"] = 20
+            db["changed"] = 200
+            del db["deleted"]
+            db["added"] = 4
+            raise RuntimeError
+    assert db == {"kept": 1, "changed": 2, "deleted": 3}
+    assert not db.dirty
+    assert FileDB(backend=JSONBackend(db.filename)) == db
+
+
+def test_batch_rollback_undoes_clear(db):
+    db.update({"a": 1, "b": 2})
+    with pytest.raises(RuntimeError):
+        with db.batch():
+            db.pop("a")
+            db.clear()
+            db["c"] = 3
+            raise RuntimeError
+    assert db == {"a": 1, "b": 2}
+
+
+def test_batch_writes_once_on_success(db):
+    with db.batch():
+        db["a"] = 1
+        with db.batch():
+            db["b"] = 2
+        assert FileDB(backend=JSONBackend(db.filename)) == {}
+    assert FileDB(backend=JSONBackend(db.filename)) == {"a": 1, "b": 2}
+
+
+def test_log_compaction_keeps_other_writers_keys(tmp_path):
+    filename = str(tmp_path / "db.log")
+    a = FileDB(backend=LogBackend(filename, compact_min=0))
+    b = FileDB(backend=LogBackend(filename, compact_min=0))
+    b["from_b"] = 1
+    for n in range(10):
+        a["from_a"] = n  # compacts along the way
+    assert FileDB(backend=LogBackend(filename)) == {"from_a": 9, "from_b": 1}
+    b["from_b"] = 2  # appends to the compacted log, not the replaced one
+    assert FileDB(backend=LogBackend(filename)) == {"from_a": 9, "from_b": 2}
+
+
+def test_log_appender_reopens_a_log_compacted_while_it_waited(tmp_path, monkeypatch):
+    filename = str(tmp_path / "db.log")
+    a, b = LogBackend(filename), LogBackend(filename)
+    a.save({}, {"from_a": 1}, False)
+    # b opened the log just before a replaced it, and only then got the lock.
+    opened = [open(filename, "a+")]
+    a.compact()
+    monkeypatch.setattr(filedb, "open", lambda *args: opened.pop() if opened else open(*args),
+                        raising=False)
+    b.save({}, {"from_b": 1}, False)
+    with open(filename) as f:
+        assert LogBackend.replay(f)[0] == {"from_a": 1, "from_b": 1}
@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+from frames import FrameBuffer
+
+
+def publish_delta(buffer, name: bytes, tile: bytes = b"t"):
+    return buffer.publish(name * 100, tiles=[(0, 0, tile)])
+
+
+def test_updates_sends_nothing_to_an_up_to_date_viewer():
+    buffer = FrameBuffer(4)
+    assert buffer.updates(0) == []
+    frame = buffer.publish(b"a")
+    assert buffer.updates(frame.seq) == []
+
+
+def test_updates_sends_missed_deltas_in_order():
+    buffer = FrameBuffer(4)
+    buffer.publish(b"a" * 100)
+    missed = [publish_delta(buffer, name) for name in (b"b", b"c", b"d")]
+    assert buffer.updates(1) == missed
+    assert json.loads(missed[0].payload(1))["key"] is False
+
+
+def test_updates_skips_to_newest_frame_when_deltas_are_gone():
+    buffer = FrameBuffer(2)
+    buffer.publish(b"a" * 100)
+    frames = [publish_delta(buffer, name) for name in (b"b", b"c", b"d")]
+    assert buffer.updates(1) == [frames[-1]]
+    assert json.loads(frames[-1].payload(1))["key"] is True
+
+
+def test_updates_skips_to_newest_frame_when_deltas_outweigh_it():
+    buffer = FrameBuffer(4)
+    buffer.publish(b"a")
+    frames = [buffer.publish(name, tiles=[(0, 0, name * 10)]) for name in (b"b", b"c")]
+    assert buffer.updates(1) == [frames[-1]]
+
+
+def test_unchanged_frames_are_not_published():
+    buffer = FrameBuffer(4)
+    assert buffer.publish(b"a") is not None
+    assert buffer.publish(b"a") is None
+    assert buffer.latest().seq == 1
+
+
+def test_resume_ahead_of_the_buffer_gets_a_key_frame():
+    buffer = FrameBuffer(4)
+    buffer.publish(b"a")
+    frame = publish_delta(buffer, b"b")
+    assert buffer.updates(500) == [frame]
+    assert json.loads(frame.payload(500))["key"] is True
+    assert buffer.wait(500, timeout=0) is frame
+
+
+def test_polling_viewer_ahead_of_the_buffer_is_sent_the_frame():
+    buffer = FrameBuffer(4)
+    frame = buffer.publish(b"a")
+    assert frame.seen_by(frame.seq)
+    assert not frame.seen_by(500)
+    assert not frame.seen_by(0)
+    assert not frame.seen_by(None)
+
+
+def test_wait_times_out_without_new_frames():
+    buffer = FrameBuffer(4)
+    assert buffer.wait(0, timeout=0) is None
+    frame = buffer.publish(b"a")
+    assert buffer.wait(0, timeout=0) is frame
+    assert buffer.wait(frame.seq, timeout=0) is None
+
+
+def test_wait_async_is_woken_by_publish():
+    buffer = FrameBuffer(4)
+
+    async def main():
+        waiter = asyncio.create_task(buffer.wait_async(0, timeout=5))
+        await asyncio.sleep(0)
+        frame = buffer.publish(b"a")
+        assert await waiter is frame
+        assert await buffer.wait_async(500, timeout=0) is frame
+        assert await buffer.wait_async(frame.seq, timeout=0.01) is None
+
+    asyncio.run(main())
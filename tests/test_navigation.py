@@ -0,0 +1,98 @@
+from navigation import (CANCELLED, COMPLETE, FAILED, INTERACTIVE, LOADING, QUEUED,
+                        NavigationTracker)
+
+
+def navigated(loader_id: str, url: str = "https://example.com/", parent: str = None):
+    frame = {"loaderId": loader_id, "url": url}
+    if parent:
+        frame["parentId"] = parent
+    return "Page.frameNavigated", {"frame": frame}
+
+
+def lifecycle(loader_id: str, name: str):
+    return "Page.lifecycleEvent", {"loaderId": loader_id, "name": name}
+
+
+def test_job_follows_lifecycle_events():
+    tracker = NavigationTracker(timeout=10)
+    job, superseded = tracker.create("https://example.com/")
+    assert superseded is None and job.state == QUEUED
+    tracker.started(job, "L1", "https://example.com/")
+    assert job.state == LOADING
+    tracker.on_page_event(*lifecycle("L1", "DOMContentLoaded"))
+    assert job.state == INTERACTIVE
+    tracker.on_page_event(*lifecycle("L1", "load"))
+    assert job.state == COMPLETE and job.done
+
+
+def test_events_before_the_loader_id_is_known_are_caught_up_on():
+    tracker = NavigationTracker(timeout=10)
+    job, _ = tracker.create("https://example.com/")
+    tracker.on_page_event(*navigated("L1", "https://example.com/landing"))
+    tracker.on_page_event(*lifecycle("L1", "load"))
+    tracker.started(job, "L1", "https://example.com/")
+    assert job.state == COMPLETE
+    assert job.current_url == "https://example.com/landing"
+
+
+def test_other_frames_and_loaders_are_ignored():
+    tracker = NavigationTracker(timeout=10)
+    job, _ = tracker.create("https://example.com/")
+    tracker.started(job, "L1")
+    tracker.on_page_event(*navigated("L2", "https://ads.example/", parent="main"))
+    tracker.on_page_event(*lifecycle("L2", "load"))
+    assert job.state == LOADING and job.current_url is None
+
+
+def test_states_never_go_backwards():
+    tracker = NavigationTracker(timeout=10)
+    job, _ = tracker.create("https://example.com/")
+    tracker.started(job, "L1")
+    tracker.update(job, INTERACTIVE)
+    tracker.update(job, LOADING)
+    assert job.state == INTERACTIVE
+    tracker.update(job, COMPLETE)
+    tracker.fail(job, "too late")
+    assert job.state == COMPLETE and job.error is None
+
+
+def test_same_document_navigation_completes_at_once():
+    tracker = NavigationTracker(timeout=10)
+    job, _ = tracker.create("#anchor")
+    tracker.started(job, None, "https://example.com/#anchor")
+    assert job.state == COMPLETE
+
+
+def test_new_job_supersedes_the_current_one():
+    tracker = NavigationTracker(timeout=10)
+    first, _ = tracker.create("https://example.com/")
+    second, superseded = tracker.create("https://example.org/")
+    assert superseded is first and first.state == CANCELLED
+    assert tracker.current() is second
+    assert not tracker.starting(first) and tracker.starting(second)
+
+
+def test_cancel_reports_whether_loading_had_begun():
+    tracker = NavigationTracker(timeout=10)
+    queued, _ = tracker.create("https://example.com/")
+    assert tracker.cancel(queued) is False and queued.state == CANCELLED
+    loading, _ = tracker.create("https://example.org/")
+    tracker.started(loading, "L1")
+    assert tracker.cancel(loading) is True
+    assert tracker.cancel(loading) is False
+
+
+def test_loading_jobs_time_out():
+    tracker = NavigationTracker(timeout=0)
+    job, _ = tracker.create("https://example.com/")
+    assert tracker.get(job.id).state == QUEUED
+    tracker.started(job, "L1")
+    assert tracker.get(job.id).state == FAILED
+    assert job.error == "Timed out"
+
+
+def test_history_is_bounded():
+    tracker = NavigationTracker(timeout=10, history=2)
+    jobs = [tracker.create(f"https://example.com/{n}")[0] for n in range(3)]
+    assert tracker.get(jobs[0].id) is None
+    assert tracker.get(jobs[2].id) is jobs[2]
@@ -0,0 +1,66 @@
+import os
+import socket
+import subprocess
+import sys
+
+from profiles import ProfileManager
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def spare(root, pid: int) -> str:
+    path = os.path.join(str(root), f"{pid}-spare")
+    os.makedirs(path)
+    return path
+
+
+def test_cleanup_only_removes_orphaned_spares(tmp_path):
+    profiles = ProfileManager(str(tmp_path), 1 << 30, 1 << 20)
+    ours = profiles.new_profile()
+    released = profiles.new_profile()
+    profiles.release(released)
+    others = spare(tmp_path, os.getppid())
+    orphan = spare(tmp_path, dead_pid())
+    profiles.cleanup()
+    assert os.path.isdir(ours) and os.path.isdir(others)
+    assert not os.path.exists(released) and not os.path.exists(orphan)
+
+
+def test_cleanup_spares_profiles_a_live_chrome_holds(tmp_path):
+    profiles = ProfileManager(str(tmp_path), 1 << 30, 1 << 20)
+    locked = spare(tmp_path, dead_pid())
+    os.symlink(f"{socket.gethostname()}-{os.getpid()}", os.path.join(locked, "SingletonLock"))
+    profiles.cleanup()
+    assert os.path.isdir(locked)
+
+
+def test_profiles_owned_by_another_process_survive_the_sweep(tmp_path):
+    ours = ProfileManager(str(tmp_path), 1 << 30, 1 << 20)
+    theirs = ProfileManager(str(tmp_path), 1 << 30, 1 << 20)
+    path = spare(tmp_path, dead_pid())
+    theirs.acquire("theirs", path)
+    ours.acquire("ours")
+    ours.evict()
+    assert os.path.isdir(path)
+    assert ours.assigned("theirs") == path
+
+
+def test_usage_reports_sizes_from_the_last_sweep(tmp_path, monkeypatch):
+    profiles = ProfileManager(str(tmp_path), 1 << 30, 1 << 20)
+    path = profiles.acquire("session")
+    with open(os.path.join(path, "cache"), "wb") as f:
+        f.write(b"x" * 1000)
+    profiles.release(path)
+    assert profiles.usage()["bytes"] == 0
+    profiles.evict()
+    assert profiles.usage()["bytes"] == 1000
+
+    def walk(path):
+        raise AssertionError("unused profiles need no new walk")
+    monkeypatch.setattr("profiles.directory_size", walk)
+    profiles.evict()
+    assert profiles.usage()["bytes"] == 1000
@@ -0,0 +1,70 @@
+import pytest
+
+from filedb import FileDB, JSONBackend
+from state import StateStore
+
+ORIGIN = "https://example.com"
+
+
+class FailingItems(dict):
+    """Items that break off after the first one, like a dump cut short."""
+
+    def items(self):
+        yield from list(super().items())[:1]
+        raise RuntimeError("interrupted")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StateStore(FileDB(backend=JSONBackend(str(tmp_path / "db.json"))))
+
+
+def test_failed_storage_write_leaves_no_phantom_keys(store):
+    store.put_localstorage(ORIGIN, {"kept": "1"})
+    with pytest.raises(RuntimeError):
+        store.put_localstorage("https://other.com", FailingItems(a="1", b="2"))
+    assert store.origins() == [ORIGIN]
+    assert store.localstorage(ORIGIN) == {"kept": "1"}
+
+
+def test_sync_cookies_writes_only_what_changed(store):
+    a = {"domain": "a.com", "path": "/", "name": "a", "value": "1"}
+    b = {"domain": "b.com", "path": "/", "name": "b", "value": "1", "expiry": 100}
+    assert store.sync_cookies([a, b], now=0) == {"inserted": 2, "updated": 0, "deleted": 0, "pruned": 0}
+    assert store.sync_cookies([a, dict(b, value="2")], now=0)["updated"] == 1
+    assert store.sync_cookies([a], now=200) == {"inserted": 0, "updated": 0, "deleted": 0, "pruned": 1}
+    assert store.cookies() == [a]
+
+
+def test_migrates_legacy_cookies_and_numeric_localstorage_keys(tmp_path):
+    db = FileDB(backend=JSONBackend(str(tmp_path / "db.json")))
+    cookie = {"domain": "example.com", "path": "/", "name": "a", "value": "1"}
+    db.update({"0": cookie, "123": "stored", "theme": "dark"})
+    store = StateStore(db, ORIGIN)
+    assert store.cookies() == [cookie]
+    assert store.localstorage(ORIGIN) == {"123": "stored", "theme": "dark"}
+
+
+def test_numeric_keys_that_are_not_cookies_are_left_alone_without_an_origin(tmp_path):
+    db = FileDB(backend=JSONBackend(str(tmp_path / "db.json")))
+    db.update({"123": "stored"})
+    store = StateStore(db)
+    assert not store.has_cookies()
+    assert db == {"123": "stored"}
+
+
+def test_interrupted_indexeddb_dump_leaves_no_stale_chunks(store):
+    def chunks(count, fail=False):
+        for n in range(count):
+            yield "db", "store", [n]
+        if fail:
+            raise RuntimeError("interrupted")
+
+    store.put_indexeddb(ORIGIN, ["schema"], chunks(3))
+    with pytest.raises(RuntimeError):
+        store.put_indexeddb(ORIGIN, ["schema"], chunks(4, fail=True))
+    assert not store.has_indexeddb(ORIGIN)
+    assert store.put_indexeddb(ORIGIN, ["schema"], chunks(1)) == 1
+    assert sorted(key for key in store.db if key.startswith("idb:")) == \
+        ['idb:["https://example.com", 0]', 'idb:["https://example.com"]']
+    assert list(store.indexeddb(ORIGIN)[1]) == [("db", "store", [0])]
@@ -1,129 +1,120 @@
 from __future__ import annotations
 
-import json
 import os
-from time import sleep
+from time import monotonic, sleep
 from urllib.parse import urlparse, urljoin
+import atexit
 import base64
+import re
 import threading
+import uuid
 
 from selenium.webdriver import Chrome, ChromeOptions
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException, InvalidArgumentException, StaleElementReferenceException, ElementNotInteractableException
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.keys import Keys
+from selenium.common.exceptions import WebDriverException, InvalidArgumentException, StaleElementReferenceException, ElementNotInteractableException
 
-from flask import Flask, render_template, request, jsonify, Response
+from flask import Flask, render_template, request, jsonify, Response, abort, make_response
 
 from selenium.webdriver import Chrome
 
+from filedb import FileDB, JSONBackend, LogBackend, SQLiteBackend
+from localstorage import LocalStorage, SessionStorage, IndexedDB
+from channel import serve_channels
+from frames import FrameBuffer, RateController
+from inputs import ActionsBatch, InputDispatcher, Viewport
+from state import StateStore, origin_of
+from encoders import FramePipeline, ImageEncoder
+from screencast import Screencast
+from scheduler import DriverScheduler, PRIORITY_INPUT, PRIORITY_NAVIGATE, PRIORITY_CAPTURE, PRIORITY_MAINTENANCE
+from navigation import NavigationJob, NavigationTracker, CANCELLED, LOADING, QUEUED, READY_STATES
+from profiles import ProfileManager
+from sessions import SessionManager, SessionLimitError, SessionReaper, WarmPool, process_tree_rss
 
-class LocalStorage:
-
-    def __init__(self, driver: Chrome):
-        self.driver = driver
-
-    def __len__(self):
-        return self.driver.execute_script("return window.localStorage.length;")
-
-    def items(self):
-        return self.driver.execute_script( \
-            "var items = {}; " \
-            "for (var i = 0, k; i < localStorage.length; ++i) " \
-            "  items[k = localStorage.key(i)] = localStorage.getItem(k); " \
-            "return items; ")
-
-    def keys(self):
-        return self.driver.execute_script( \
-            "var keys = []; " \
-            "for (var i = 0; i < localStorage.length; ++i) " \
-            "  keys[i] = localStorage.key(i); " \
-            "return keys; ")
-
-    def get(self, key):
-        return self.driver.execute_script(
-            "return localStorage.getItem(arguments[0]);", key)
-
-    def set(self, key, value):
-        self.driver.execute_script(
-            "localStorage.setItem(arguments[0], arguments[1]);", key,
-            value)
-
-    def has(self, key):
-        return key in self.keys()
-
-    def remove(self, key):
-        self.driver.execute_script(
-            "window.localStorage.removeItem(arguments[0]);", key)
-
-    def clear(self):
-        self.driver.execute_script("window.localStorage.clear();")
-
-    def __getitem__(self, key):
-        value = self.get(key)
-        if value is None:
-            raise KeyError(key)
-        return value
-
-    def __setitem__(self, key, value):
-        self.set(key, value)
-
-    def __contains__(self, key):
-        return key in self.keys()
-
-    def __iter__(self):
-        return self.items().__iter__()
-
-    def __repr__(self):
-        return self.items().__str__()
 
 # Configuration
 SINGLE_PAGE = ""
 DB_FILENAME = "db.json"
+# Seconds between write-behind flushes of FileDB; None writes every change through.
+DB_FLUSH_INTERVAL = 2.0
+# "json" keeps one file per session, "sqlite" shares SQLITE_FILENAME between all
+# sessions and processes, "log" appends changes to a per-session log.
+DB_BACKEND = "json"
+SQLITE_FILENAME = "db.sqlite"
+# Seconds between saves of changed cookies for sessions that were used meanwhile.
+COOKIE_SYNC_INTERVAL = 60
+# Records per async script call when dumping or restoring IndexedDB.
+IDB_CHUNK_SIZE = 500
+# Directory for persistent per-session Chrome profiles, None for throwaway ones. Unused
+# profiles are evicted least recently used first beyond PROFILE_MAX_MB on disk.
+PROFILE_DIR = "profiles"
+PROFILE_MAX_MB = 2048
+PROFILE_CACHE_MB = 100
+# Navigations still loading after this many seconds are reported as timed out.
+NAVIGATION_TIMEOUT = 10
+# Page events drive navigation progress while the screencast runs; after this many
+# seconds without any, polls check document.readyState as well.
+NAVIGATION_EVENT_GRACE = 1.0
 SCREENSHOT_INTERVAL = 0.1
+# Slower rate once the page saw no input or change for IDLE_AFTER seconds.
+IDLE_SCREENSHOT_INTERVAL = 1.0
+IDLE_AFTER = 5
+# "screencast" streams frames from Chrome over DevTools, "poll" calls get_screenshot_as_png.
+CAPTURE_BACKEND = "screencast"
+SCREENCAST_FORMAT = "jpeg"
+SCREENCAST_QUALITY = 80
+# Encoded frames kept per session, so viewers a few frames behind can still catch up with deltas.
+FRAME_BUFFER_SIZE = 8
+STREAM_BOUNDARY = "frame"
+STREAM_TIMEOUT = 30
+# Port of the WebSocket server carrying each viewer's input and frames, None to only use HTTP.
+CHANNEL_PORT = 8081
+# Path of the channel when asgi.py serves it on the app's own port; set by asgi.py.
+CHANNEL_PATH = None
+# Codec for published frames: "png", "jpeg" or "webp", downscaled to fit FRAME_MAX_* if set.
+# Captures already in this format, size and quality are published without re-encoding them.
+FRAME_FORMAT = SCREENCAST_FORMAT
+FRAME_QUALITY = SCREENCAST_QUALITY
+FRAME_MAX_WIDTH = None
+FRAME_MAX_HEIGHT = None
+# Each session gets its own browser; requests without a session id share DEFAULT_SESSION,
+# which keeps using DB_FILENAME.
+MAX_SESSIONS = 4
+DEFAULT_SESSION = "default"
+SESSION_COOKIE = "session_id"
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+SESSION_DB_DIR = "sessions"
+# Number of blank browsers kept launched for new sessions, 0 to launch on demand.
+WARM_POOL_SIZE = 1
+# Sessions without requests or viewers for SESSION_TTL seconds are closed, and the
+# least recently used ones go first while our browsers use more than MAX_RSS_MB.
+SESSION_TTL = 15 * 60
+MAX_RSS_MB = 4096
+REAPER_INTERVAL = 30
+
+def open_db(session_id: str) -> FileDB:
+    """Opens a session's store with the configured DB_BACKEND."""
+    if DB_BACKEND == "sqlite":
+        backend = SQLiteBackend(SQLITE_FILENAME, namespace=session_id)
+    elif DB_BACKEND == "log":
+        backend = LogBackend(session_db_filename(session_id, ".log"))
+    elif session_id == DEFAULT_SESSION:
+        backend = JSONBackend(DB_FILENAME)
+    else:
+        backend = JSONBackend(session_db_filename(session_id))
+    return FileDB(backend=backend, flush_interval=DB_FLUSH_INTERVAL)
 
-class FileDB(dict):
-    """File-based key-value storage."""
-    def __init__(self, filename: str = DB_FILENAME):
-        self.filename = filename
-        self.load()
-
-    def load(self):
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, "r") as f:
-                    data = json.load(f)
-                    super().__init__(data)
-            except (FileNotFoundError, json.JSONDecodeError):
-                super().__init__()
-        else:
-            super().__init__()
-
-    def _save(self):
-        try:
-            with open(self.filename, "w") as f:
-                json.dump(self, f, indent=2)
-        except IOError as e:
-            print(f"Error saving to {self.filename}: {e}")
-
-    def __setitem__(self, key, value):
-        super().__setitem__(key, value)
-        self._save()
-
-    def __delitem__(self, key):
-        super().__delitem__(key)
-        self._save()
+def session_db_filename(session_id: str, extension: str = ".json") -> str:
+    os.makedirs(SESSION_DB_DIR, exist_ok=True)
+    return os.path.join(SESSION_DB_DIR, f"{session_id}{extension}")
 
-    def clear(self):
-        super().clear()
-        self._save()
+def open_state(session_id: str, store: FileDB = None) -> StateStore:
+    legacy_origin = origin_of(SINGLE_PAGE) if SINGLE_PAGE else None
+    return StateStore(store if store is not None else open_db(session_id), legacy_origin)
 
-db = FileDB()
+db = open_db(DEFAULT_SESSION)
+state = open_state(DEFAULT_SESSION, db)
 
-def is_cookies() -> bool:
-    return any(key.isnumeric() for key in db)
+def is_cookies(store: StateStore = state) -> bool:
+    return store.has_cookies()
 
 def assemble_url(cookie: dict) -> str:
     url = "https://" if cookie.get("secure", False) else "http://"
@@ -131,66 +122,149 @@ def assemble_url(cookie: dict) -> str:
     url += cookie["path"]
     return url
 
-def save_cookies(driver: Chrome) -> None:
+def save_cookies(driver: Chrome, store: StateStore = state) -> None:
     print("Saving cookies...", end=" ")
     try:
-        for key in list(db.keys()):
-            if key.isnumeric():
-                del db[key]
-        for index, value in enumerate(driver.get_cookies()):
-            db[str(index)] = value
-        print("done")
+        # driver.get_cookies() only sees the current page's; syncing those would drop the rest.
+        cookies = driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+        changes = store.sync_cookies([webdriver_cookie(cookie) for cookie in cookies])
+        print("done", ", ".join(f"{count} {kind}" for kind, count in changes.items() if count))
     except Exception as e:
         print("fail", e)
 
-def load_cookies(driver: Chrome) -> None:
+def cdp_cookie(cookie: dict) -> dict:
+    """Converts a WebDriver cookie into a DevTools Network.CookieParam."""
+    param = {key: cookie[key] for key in ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite")
+             if key in cookie}
+    if "expiry" in cookie:
+        param["expires"] = cookie["expiry"]
+    return param
+
+def webdriver_cookie(cookie: dict) -> dict:
+    """Converts a DevTools Network.Cookie into a WebDriver cookie, the way they are saved."""
+    converted = {key: cookie[key] for key in ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite")
+                 if key in cookie}
+    # Session cookies have no expiry; DevTools reports them with expires -1.
+    if not cookie.get("session") and cookie.get("expires", -1) > 0:
+        converted["expiry"] = int(cookie["expires"])
+    return converted
+
+def wait_for_page(driver: Chrome, url: str = None, timeout: float = NAVIGATION_TIMEOUT) -> bool:
+    """Waits for the page, on `url`'s host if given, to finish loading after driver.get.
+
+    Needed before touching the document, since with page_load_strategy
+    'none' driver.get does not wait. Returns False on timeout.
+    """
+    host = urlparse(url).hostname if url else None
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        ready_state, current_url = driver.execute_script("return [document.readyState, location.href];")
+        if ready_state == 'complete' and current_url not in ('about:blank', 'data:,') \
+                and (host is None or urlparse(current_url).hostname == host):
+            return True
+        sleep(0.05)
+    return False
+
+def load_cookies(driver: Chrome, store: StateStore = state) -> None:
+    """Restores every saved cookie in one DevTools call, without navigating.
+
+    Falls back to add_cookie, grouped so that each host is visited once.
+    """
     print("Loading cookies...", end=" ")
+    cookies = store.cookies()
+    try:
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": [cdp_cookie(c) for c in cookies]})
+        print("done")
+        return
+    except Exception as e:
+        print("Network.setCookies failed, falling back to add_cookie:", e, end=" ")
+
+    by_host = {}
+    for cookie in cookies:
+        by_host.setdefault(cookie["domain"].lstrip("."), []).append(cookie)
     try:
-        for key in sorted([key for key in db if key.isnumeric()], key=int):
-            cookie: dict = db[key]
-            url = assemble_url(cookie)
+        for host, host_cookies in by_host.items():
+            url = assemble_url(host_cookies[0])
             if urlparse(driver.current_url).hostname != urlparse(url).hostname:
                 driver.get(url)
-            driver.add_cookie(cookie)
+                wait_for_page(driver, url)
+            for cookie in host_cookies:
+                try:
+                    driver.add_cookie(cookie)
+                except WebDriverException as e:
+                    print(f"skipping cookie {cookie['name']} for {host}:", e, end=" ")
         print("done")
     except Exception as e:
         print("fail", e)
 
-def is_localstorage() -> bool:
-    return any(key.isalpha() for key in db)
+def is_localstorage(store: StateStore = state, origin: str = None) -> bool:
+    return store.has_localstorage(origin)
 
-def save_localstorage(ls: LocalStorage) -> None:
+def save_localstorage(ls: LocalStorage, store: StateStore = state) -> None:
     print("Saving LocalStorage...", end=" ")
     try:
-        for key, value in ls.items():
-            db[key] = value
+        store.put_localstorage(origin_of(ls.driver.current_url), ls.items(), replace=True)
         print("done")
     except Exception as e:
         print("fail", e)
 
-def load_localstorage(ls: LocalStorage) -> None:
+def load_localstorage(ls: LocalStorage, store: StateStore = state) -> None:
     print("Loading LocalStorage...", end=" ")
     assert SINGLE_PAGE, "SINGLE_PAGE must be set for LocalStorage to work."
     try:
-        for key in [key for key in db if key.isalpha()]:
-            ls[key] = db[key]
+        ls.update(store.localstorage(origin_of(ls.driver.current_url)))
         print("done")
     except Exception as e:
         print("fail", e)
 
-# --- Flask App Setup ---
-app = Flask(__name__)
-driver = None
-ls = None
-latest_screenshot = None
-screenshot_lock = threading.Lock()
-driver_lock = threading.Lock()  # Lock for driver access
-
-def initialize_driver():
-    global driver, ls
-    if driver:
-        return
+def save_sessionstorage(ss: SessionStorage, store: StateStore = state) -> None:
+    print("Saving sessionStorage...", end=" ")
+    try:
+        store.put_sessionstorage(origin_of(ss.driver.current_url), ss.items(), replace=True)
+        print("done")
+    except Exception as e:
+        print("fail", e)
+
+def load_sessionstorage(ss: SessionStorage, store: StateStore = state) -> None:
+    print("Loading sessionStorage...", end=" ")
+    try:
+        ss.update(store.sessionstorage(origin_of(ss.driver.current_url)))
+        print("done")
+    except Exception as e:
+        print("fail", e)
+
+def save_indexeddb(idb: IndexedDB, store: StateStore = state) -> None:
+    print("Saving IndexedDB...", end=" ")
+    try:
+        origin = origin_of(idb.driver.current_url)
+        chunks = store.put_indexeddb(origin, idb.schema(), idb.dump())
+        print(f"done, {chunks} chunks")
+    except Exception as e:
+        print("fail", e)
+
+def load_indexeddb(idb: IndexedDB, store: StateStore = state, origin: str = None) -> None:
+    """Restores the saved IndexedDB of `origin`, by default the current page's.
+
+    Off the driver thread, pass the origin: reading current_url there would
+    bypass the scheduler.
+    """
+    print("Loading IndexedDB...", end=" ")
+    try:
+        saved = store.indexeddb(origin or origin_of(idb.driver.current_url))
+        if saved:
+            idb.restore(*saved)
+        print("done")
+    except Exception as e:
+        print("fail", e)
+
+# --- Browser Sessions ---
+# Persistent per-session Chrome profiles, so HTTP caches survive restarts.
+profiles = ProfileManager(PROFILE_DIR, PROFILE_MAX_MB * 1024 * 1024,
+                          PROFILE_CACHE_MB * 1024 * 1024) if PROFILE_DIR else None
+if profiles:
+    profiles.cleanup()
 
+def launch_chrome(profile: str = None) -> Chrome:
     chrome_options = ChromeOptions()
     chrome_options.add_argument('--no-sandbox')
     chrome_options.add_argument('--disable-dev-shm-usage')
@@ -199,156 +273,541 @@ def initialize_driver():
     #NEW: disable infobars
     chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
     chrome_options.add_experimental_option('useAutomationExtension', False)
-
+    # driver.get returns once the navigation started; navigation jobs track the rest.
+    chrome_options.page_load_strategy = 'none'
 
     if SINGLE_PAGE:
         chrome_options.add_argument('--kiosk')
     else:
         chrome_options.add_argument("start-maximized")
 
-    driver = Chrome(options=chrome_options)
-    ls = LocalStorage(driver)
-
-    if not SINGLE_PAGE:
-        driver.get("https://google.com")
-    else:
-        driver.get(SINGLE_PAGE)
-
-    if is_cookies():
-        print("Found some cookies to restore!")
-        load_cookies(driver)
+    if profiles:
+        profile = profile or profiles.new_profile()
+        for argument in profiles.chrome_arguments(profile):
+            chrome_options.add_argument(argument)
 
-    if SINGLE_PAGE and is_localstorage():
-        print("Found some LocalStorage data to restore!")
-        load_localstorage(ls)
+    try:
+        driver = Chrome(options=chrome_options)
+    except Exception:
+        if profile:
+            profiles.release(profile)
+        raise
+    driver.profile_dir = profile
+    return driver
+
+# Blank browsers launched ahead of time, handed to sessions as they start.
+warm_pool = WarmPool(launch_chrome, WARM_POOL_SIZE).start()
+atexit.register(warm_pool.close)
+
+class BrowserSession:
+    """One user's browser: its driver, driver thread, frames and saved state."""
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.db = db if session_id == DEFAULT_SESSION else open_db(session_id)
+        self.state = state if session_id == DEFAULT_SESSION else open_state(session_id, self.db)
+        self.driver = None
+        self.ls = None
+        self.ss = None
+        self.idb = None
+        # Every WebDriver call for this browser goes through here, see DriverScheduler.
+        self.scheduler = DriverScheduler(name=f"driver-{session_id}")
+        self.frames = FrameBuffer(FRAME_BUFFER_SIZE)
+        self.rate = RateController(SCREENSHOT_INTERVAL, IDLE_SCREENSHOT_INTERVAL, IDLE_AFTER)
+        self.pipeline = FramePipeline(
+            ImageEncoder(FRAME_FORMAT, FRAME_QUALITY, FRAME_MAX_WIDTH, FRAME_MAX_HEIGHT))
+        self.navigation = NavigationTracker(NAVIGATION_TIMEOUT)
+        self.viewport = Viewport(self.measure_viewport)
+        self.input = InputDispatcher(self.viewport)
+        self.closed = threading.Event()
+        self.created = monotonic()
+        self.last_active = self.created
+        self.last_sync = self.created
+        self.first_frame_after = None
+        self._screencast = None
+        self._capture_thread = threading.Thread(
+            target=self.capture_screenshots, name=f"capture-{session_id}", daemon=True)
+
+    def start(self):
+        self._capture_thread.start()
+        threading.Thread(target=self.sync_periodically, name=f"sync-{self.id}", daemon=True).start()
+        return self
+
+    def sync_state(self):
+        """Saves cookie changes; the session's FileDB writes only what changed."""
+        if not self.driver:
+            return
+        self.last_sync = monotonic()
+        save_cookies(self.driver, self.state)
+
+    def sync_periodically(self):
+        while not self.closed.wait(COOKIE_SYNC_INTERVAL):
+            # Cookies only change when someone uses the browser.
+            if self.last_active <= self.last_sync:
+                continue
+            try:
+                self.scheduler.call(self.sync_state, priority=PRIORITY_MAINTENANCE)
+            except Exception as e:
+                print(f"Error syncing state for session {self.id}: {e}")
+
+    @property
+    def viewers(self) -> int:
+        return self.rate.viewers
+
+    def touch(self):
+        self.last_active = monotonic()
+
+    def idle_for(self) -> float:
+        """Seconds since the last request; a session being watched is never idle."""
+        if self.viewers:
+            return 0.0
+        return monotonic() - self.last_active
+
+    def initialize_driver(self):
+        if self.driver:
+            return
+        if self.closed.is_set():
+            raise RuntimeError("Session closed")
+
+        if profiles and profiles.assigned(self.id):
+            # A returning session gets its own profile back, warm HTTP cache included.
+            driver = launch_chrome(profiles.acquire(self.id))
+        else:
+            driver = warm_pool.acquire()
+            if profiles:
+                profiles.acquire(self.id, driver.profile_dir)
+        self.driver = driver
+        self.ls = LocalStorage(driver)
+        self.ss = SessionStorage(driver)
+        self.idb = IndexedDB(driver, IDB_CHUNK_SIZE, execute=self.execute_async_script)
 
-    print("Driver initialized.")
+        # Cookies go in before the first page load so it already sees them.
+        if is_cookies(self.state):
+            print("Found some cookies to restore!")
+            load_cookies(driver, self.state)
 
-def capture_screenshots():
-    global latest_screenshot
-    initialize_driver()
-    while True:
+        if not SINGLE_PAGE:
+            driver.get("https://google.com")
+        else:
+            driver.get(SINGLE_PAGE)
+            # Saved storage goes into the page's own origin, so it has to be there first.
+            if not wait_for_page(driver, SINGLE_PAGE):
+                print(f"Timed out waiting for {SINGLE_PAGE} to load.")
+
+        if SINGLE_PAGE and is_localstorage(self.state, origin_of(SINGLE_PAGE)):
+            print("Found some LocalStorage data to restore!")
+            load_localstorage(self.ls, self.state)
+
+        if SINGLE_PAGE and self.state.has_sessionstorage(origin_of(SINGLE_PAGE)):
+            print("Found some sessionStorage data to restore!")
+            load_sessionstorage(self.ss, self.state)
+
+        print(f"Driver initialized for session {self.id}.")
+
+    def execute_async_script(self, script, *args):
+        """Runs one async script through the scheduler, so input can go in between chunks."""
+        return self.scheduler.call(self.driver.execute_async_script, script, *args,
+                                   priority=PRIORITY_MAINTENANCE)
+
+    def restore_indexeddb(self):
+        """Writes saved IndexedDB data back chunk by chunk, then reloads the page to pick it up."""
+        if not (SINGLE_PAGE and self.driver and self.state.has_indexeddb(origin_of(SINGLE_PAGE))):
+            return
+        print("Found some IndexedDB data to restore!")
+        # Runs on the capture thread; the chunks go through the scheduler, see execute_async_script.
+        load_indexeddb(self.idb, self.state, origin_of(SINGLE_PAGE))
+        self.scheduler.call(self.driver.refresh, priority=PRIORITY_NAVIGATE)
+
+    def take_screenshot(self) -> bytes:
+        if not self.driver:
+            raise RuntimeError("Driver not initialized")
+        return self.driver.get_screenshot_as_png()
+
+    def publish_capture(self, raw: bytes, quality: int = None) -> None:
+        encoded = self.pipeline.process(raw, quality)
+        if encoded:
+            data, mime, digest, tiles = encoded
+            frame = self.frames.publish(data, mime, digest, tiles)
+            if frame and self.first_frame_after is None:
+                self.first_frame_after = monotonic() - self.created
+            self.rate.touch()
+
+    def on_screencast_frame(self, raw: bytes, metadata: dict = None) -> None:
+        if metadata and metadata.get('deviceWidth'):
+            # Frame metadata tracks the viewport for free, resizes included.
+            self.viewport.update(metadata['deviceWidth'], metadata['deviceHeight'])
+        self.publish_capture(raw, SCREENCAST_QUALITY)
+        # Holding back the ack keeps Chrome from sending frames faster than we want them.
+        self.rate.wait()
+
+    def capture_screenshots(self):
         try:
-            with screenshot_lock:
-                screenshot = driver.get_screenshot_as_png()
-                latest_screenshot = base64.b64encode(screenshot).decode('utf-8')
-            sleep(SCREENSHOT_INTERVAL)
+            self.scheduler.call(self.initialize_driver, priority=PRIORITY_NAVIGATE)
+            self.restore_indexeddb()
         except Exception as e:
-            print(f"Error in capture_screenshots: {e}")
+            print(f"Error initializing driver for session {self.id}: {e}")
+        while CAPTURE_BACKEND == "screencast" and not self.closed.is_set():
+            try:
+                self._screencast = Screencast(self.driver, self.on_screencast_frame,
+                                              SCREENCAST_FORMAT, SCREENCAST_QUALITY,
+                                              FRAME_MAX_WIDTH, FRAME_MAX_HEIGHT,
+                                              on_event=self.on_page_event)
+                self.scheduler.call(self._screencast.start, priority=PRIORITY_CAPTURE)
+            except Exception as e:
+                print(f"Screencast unavailable, falling back to polling: {e}")
+                break
+            print(f"Screencast started for session {self.id}.")
+            self._screencast.wait()
             sleep(1)
 
-screenshot_thread = threading.Thread(target=capture_screenshots, daemon=True)
-screenshot_thread.start()
+        while not self.closed.is_set():
+            try:
+                self.publish_capture(
+                    self.scheduler.call(self.take_screenshot, priority=PRIORITY_CAPTURE))
+                self.rate.wait()
+            except Exception as e:
+                if self.closed.is_set():
+                    break
+                print(f"Error in capture_screenshots: {e}")
+                sleep(1)
+
+    def on_page_event(self, method: str, params: dict) -> None:
+        self.navigation.on_page_event(method, params)
+        if method == 'Page.frameResized' or (method == 'Page.frameNavigated'
+                                             and not params.get('frame', {}).get('parentId')):
+            self.viewport.invalidate()
+
+    def measure_viewport(self):
+        return tuple(self.driver.execute_script("return [window.innerWidth, window.innerHeight];"))
+
+    def navigate(self, url: str) -> NavigationJob:
+        """Queues a navigation and returns its job right away, cancelling the previous one."""
+        job, superseded = self.navigation.create(url)
+        if superseded:
+            print(f"Navigation to {superseded.url} superseded in session {self.id}.")
+        job.future = self.scheduler.submit(self.start_navigation, job, priority=PRIORITY_NAVIGATE)
+        self.rate.touch()
+        return job
+
+    def start_navigation(self, job: NavigationJob) -> None:
+        """Starts loading a job's URL without waiting for the page to load."""
+        if not self.navigation.starting(job):
+            return
+        try:
+            self.initialize_driver()
+            driver = self.driver
+            url = job.url
+            if not url.startswith(('http://', 'https://')):
+                current_url = driver.current_url
+                if current_url == 'data:,':
+                    current_url = 'https://www.google.com'
+                url = urljoin(current_url, url)
+            self.viewport.invalidate()
+            # Unlike driver.get, Page.navigate returns once the navigation committed.
+            result = driver.execute_cdp_cmd("Page.navigate", {"url": url})
+        except InvalidArgumentException:
+            self.navigation.fail(job, 'Invalid URL')
+            return
+        except WebDriverException as e:
+            self.navigation.fail(job, e.msg or str(e))
+            return
+        if result.get('errorText'):
+            self.navigation.fail(job, result['errorText'])
+            return
+        self.navigation.started(job, result.get('loaderId'), url)
+
+    def poll_navigation(self, job: NavigationJob) -> None:
+        """Checks document.readyState for a loading job when no page events come in."""
+        if job.done or job.state == QUEUED:
+            return
+        if self._screencast and self._screencast.running \
+                and monotonic() - job.updated < NAVIGATION_EVENT_GRACE:
+            return
+        ready_state, current_url = self.driver.execute_script(
+            "return [document.readyState, location.href];")
+        self.navigation.update(job, READY_STATES.get(ready_state, LOADING), current_url)
+
+    def cancel_navigation(self, job: NavigationJob) -> bool:
+        """Cancels a job, stopping the page load if it had already begun."""
+        if self.navigation.cancel(job) and self.navigation.current() is job:
+            self.scheduler.call(self.driver.execute_cdp_cmd, "Page.stopLoading", {},
+                                priority=PRIORITY_INPUT)
+        return job.state == CANCELLED
+
+    def perform_input(self, events: list) -> int:
+        """Replays viewer input events in order as DevTools Input commands.
+
+        While the screencast runs they go straight over its DevTools
+        connection; otherwise the batch is one W3C Actions call.
+        """
+        self.initialize_driver()
+        commands, performed = self.input.translate(events)
+        if self._screencast and self._screencast.running:
+            self._screencast.send(commands)
+        else:
+            ActionsBatch(self.driver, commands).perform()
+        return performed
+
+    def quit_driver(self) -> bool:
+        if not self.driver:
+            return False
+        save_cookies(self.driver, self.state)
+        if SINGLE_PAGE and self.ls:
+            save_localstorage(self.ls, self.state)
+            save_sessionstorage(self.ss, self.state)
+            save_indexeddb(self.idb, self.state)
+        self.driver.quit()
+        if self.driver.profile_dir:
+            profiles.release(self.driver.profile_dir)
+        self.driver = None
+        self.ls = None
+        self.ss = None
+        self.idb = None
+        self.viewport.invalidate()
+        print(f"Driver shut down for session {self.id}.")
+        return True
+
+    def close(self) -> bool:
+        """Saves state, quits the browser and stops this session's threads."""
+        self.closed.set()
+        if self._screencast:
+            self._screencast.stop()
+        self.rate.touch()  # wake a paused capture loop so it can exit
+        try:
+            return self.scheduler.call(self.quit_driver, priority=PRIORITY_NAVIGATE)
+        finally:
+            self.scheduler.stop()
+            if self.db is db:
+                db.flush()
+            else:
+                self.db.close()
+
+    def metrics(self) -> dict:
+        first_frame = self.first_frame_after
+        return {'scheduler': self.scheduler.metrics(), 'viewers': self.viewers,
+                'idle_for': round(self.idle_for(), 1),
+                'capture_interval': self.rate.interval(),
+                'first_frame_ms': round(first_frame * 1000, 1) if first_frame is not None else None}
+
+def start_session(session_id: str) -> BrowserSession:
+    return BrowserSession(session_id).start()
+
+sessions = SessionManager(start_session, MAX_SESSIONS)
+reaper = SessionReaper(sessions, SESSION_TTL, MAX_RSS_MB * 1024 * 1024, REAPER_INTERVAL,
+                       on_sweep=profiles.evict if profiles else None).start()
+
+# --- Flask App Setup ---
+app = Flask(__name__)
+
+def resolve_session_id(*candidates) -> str:
+    """First session id given, or DEFAULT_SESSION; None if it is not a valid id."""
+    session_id = next((candidate for candidate in candidates if candidate), DEFAULT_SESSION)
+    return session_id if SESSION_ID_PATTERN.fullmatch(session_id) else None
+
+def current_session_id() -> str:
+    """Session id from ?session=, the X-Session-Id header or the session cookie."""
+    session_id = resolve_session_id(request.args.get('session'), request.headers.get('X-Session-Id'),
+                                    request.cookies.get(SESSION_COOKIE))
+    if session_id is None:
+        abort(400, 'Invalid session id')
+    return session_id
+
+def current_session(create: bool = True) -> BrowserSession:
+    session = sessions.get(current_session_id(), create)
+    if session:
+        session.touch()
+    return session
+
+def open_channel_session(query_id: str, header_id: str, cookie_id: str) -> BrowserSession:
+    """Session for a WebSocket viewer, picked like current_session() does for HTTP."""
+    session_id = resolve_session_id(query_id, header_id, cookie_id)
+    if session_id is None:
+        raise ValueError('Invalid session id')
+    session = sessions.get(session_id)
+    session.touch()
+    return session
+
+@app.errorhandler(SessionLimitError)
+def session_limit_reached(e):
+    return jsonify({'status': 'error', 'message': str(e)}), 503
+
+def channel_url():
+    """Where the page opens its viewer channel, None if there is none."""
+    scheme = 'wss' if request.is_secure else 'ws'
+    if CHANNEL_PATH:
+        return f"{scheme}://{request.host}{CHANNEL_PATH}"
+    if CHANNEL_PORT:
+        return f"{scheme}://{urlparse(request.host_url).hostname}:{CHANNEL_PORT}/"
+    return None
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    response = make_response(render_template('index.html', channel_url=channel_url()))
+    if SESSION_COOKIE not in request.cookies:
+        response.set_cookie(SESSION_COOKIE, uuid.uuid4().hex, httponly=True, samesite='Lax')
+    return response
 
 @app.route('/navigate', methods=['POST'])
 def navigate():
-    initialize_driver()
+    """Queues a navigation; poll /navigate/<job_id> for its progress."""
     url = request.form.get('url')
     if url:
+        session = current_session()
         try:
-            if not url.startswith(('http://', 'https://')):
-                current_url = driver.current_url
-                if current_url == 'data:,':
-                    current_url = 'https://www.google.com'
-                url = urljoin(current_url, url)
-
-            driver.get(url)
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.TAG_NAME, 'body'))
-            )
-            return jsonify({'status': 'success', 'current_url': driver.current_url})
-        except TimeoutException:
-            return jsonify({'status': 'error', 'message': 'Timed out'})
-        except InvalidArgumentException:
-            return jsonify({'status': 'error', 'message': 'Invalid URL'})
-        except WebDriverException as e:
+            job = session.navigate(url)
+        except RuntimeError as e:
             return jsonify({'status': 'error', 'message': str(e)})
+        return jsonify({'status': 'success', 'job_id': job.id, 'job': job.to_dict()})
     return jsonify({'status': 'error', 'message': 'No URL provided'})
 
-@app.route('/get_screenshot')
-def get_screenshot():
-    global latest_screenshot
-    with screenshot_lock:
-        if latest_screenshot:
-            return jsonify({'image': latest_screenshot})
+@app.route('/navigate/<job_id>', methods=['GET', 'DELETE'])
+def navigation_status(job_id):
+    """Reports how far a navigation got, or cancels it with DELETE."""
+    session = current_session()
+    job = session.navigation.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown navigation'}), 404
+    try:
+        if request.method == 'DELETE':
+            session.cancel_navigation(job)
         else:
-            return jsonify({'error': 'No screenshot available'})
+            session.scheduler.call(session.poll_navigation, job, priority=PRIORITY_CAPTURE)
+    except WebDriverException as e:
+        return jsonify({'status': 'error', 'message': str(e), 'job': job.to_dict()})
+    return jsonify({'status': 'success', 'job': job.to_dict()})
 
-@app.route('/interact', methods=['POST'])
-def interact():
-    """Handles user interactions (clicks and key presses)."""
-    initialize_driver()
+@app.route('/get_screenshot')
+def get_screenshot():
+    """Returns the latest frame, or 304 if the caller already has it.
+
+    Callers can pass either the ETag back in If-None-Match or the last seen
+    sequence number as ?since=<seq>.
+    """
+    session = current_session()
+    session.rate.polled()
+    frame = session.frames.latest()
+    if not frame:
+        return jsonify({'error': 'No screenshot available'})
+    since = request.args.get('since', type=int)
+    if request.if_none_match.contains_raw(frame.etag) or frame.seen_by(since):
+        return Response(status=304, headers={'ETag': frame.etag})
+    response = jsonify({'image': base64.b64encode(frame.data).decode('utf-8'),
+                        'mime': frame.mime, 'seq': frame.seq, 'timestamp': frame.timestamp})
+    response.headers['ETag'] = frame.etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def stream_frames(session: BrowserSession):
+    """Yields every new frame as a part of a multipart/x-mixed-replace body."""
+    seq = 0
+    with session.rate.watching():
+        while not session.closed.is_set():
+            frame = session.frames.wait(seq, timeout=STREAM_TIMEOUT)
+            if frame is None:
+                # Nothing new for a while, repeat the last frame so dead clients get noticed.
+                frame = session.frames.latest()
+                if frame is None:
+                    continue
+            seq = frame.seq
+            yield (f"--{STREAM_BOUNDARY}\r\n"
+                   f"Content-Type: {frame.mime}\r\n"
+                   f"Content-Length: {len(frame.data)}\r\n\r\n").encode() + frame.data + b"\r\n"
+
+def stream_tile_events(session: BrowserSession, seq: int = 0):
+    """Yields server-sent events with key frames or changed tiles only."""
+    with session.rate.watching():
+        while not session.closed.is_set():
+            if session.frames.wait(seq, timeout=STREAM_TIMEOUT) is None:
+                yield ": keepalive\n\n"
+                continue
+            for frame in session.frames.updates(seq):
+                yield frame.event(seq)
+                seq = frame.seq
+
+@app.route('/stream_tiles')
+def stream_tiles():
+    """Pushes tile deltas for the canvas compositor in the page."""
+    # A reconnecting EventSource tells us what it already has, so it can resume with deltas.
+    seq = request.headers.get('Last-Event-ID', 0, type=int)
+    return Response(stream_tile_events(current_session(), seq), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/stream')
+def stream():
+    """Pushes frames to the viewer over one long-lived response as they are captured."""
+    return Response(stream_frames(current_session()),
+                    mimetype=f'multipart/x-mixed-replace; boundary={STREAM_BOUNDARY}',
+                    headers={'Cache-Control': 'no-cache'})
+
+@app.route('/settings', methods=['GET', 'POST'])
+def settings():
+    """Reads or changes the frame codec (format, quality, max_width, max_height)."""
+    session = current_session()
+    if request.method == 'GET':
+        return jsonify({'status': 'success', 'settings': session.pipeline.encoder.settings()})
     data = request.get_json()
     if not data:
-        return jsonify({'status': 'error', 'message': 'No interaction data provided'})
+        return jsonify({'status': 'error', 'message': 'No settings provided'})
+    allowed = ('format', 'quality', 'max_width', 'max_height')
+    try:
+        encoder = session.pipeline.configure(**{key: data[key] for key in allowed if key in data})
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+    return jsonify({'status': 'success', 'settings': encoder.settings()})
 
-    action_type = data.get('type')
-    x = data.get('x')
-    y = data.get('y')
-    key = data.get('key')
-    width = data.get('width')  # Get the reported width
-    height = data.get('height') # Get the reported height
+def interaction_events(data):
+    """The ordered list of input events in an /interact body, or an error message."""
+    if not data:
+        return None, 'No interaction data provided'
+    events = data.get('events') if isinstance(data, dict) and 'events' in data else data
+    if isinstance(events, dict):
+        events = [events]
+    if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+        return None, 'Events must be a list of objects'
+    return events, None
 
-    with driver_lock:
-        try:
-            if action_type == 'click' and x is not None and y is not None:
-                if width is not None and height is not None:
-                    # Get the actual size of the browser window
-                    window_size = driver.get_window_size()
-                    actual_width = window_size['width']
-                    actual_height = window_size['height']
-
-                    # Scale the coordinates
-                    scaled_x = int(x * (actual_width / width))
-                    scaled_y = int(y * (actual_height / height))
-                else:
-                    scaled_x = x
-                    scaled_y = y
-
-                # Use ActionChains and move_by_offset
-                actions = ActionChains(driver)
-                actions.move_by_offset(scaled_x, scaled_y).click().perform()
-                actions.move_by_offset(-scaled_x, -scaled_y).perform() # Move back
-
-            elif action_type == 'keypress' and key is not None:
-                if key == 'Enter':
-                    selenium_key = Keys.ENTER
-                elif key == 'Backspace':
-                    selenium_key = Keys.BACKSPACE
-                elif key == 'Tab':
-                    selenium_key = Keys.TAB
-                else:
-                    selenium_key = key
-
-                actions = ActionChains(driver)
-                actions.send_keys(selenium_key).perform()
-
-            return jsonify({'status': 'success'})
-
-        except StaleElementReferenceException:
-            return jsonify({'status': 'error', 'message': 'Element is stale'})
-        except ElementNotInteractableException:
-            return jsonify({'status': 'error', 'message': 'Element not interactable'})
-        except Exception as e:
-            return jsonify({'status': 'error', 'message': str(e)})
+@app.route('/interact', methods=['POST'])
+def interact():
+    """Handles user interactions: one event, or a batch as {"events": [...]} in order."""
+    events, error = interaction_events(request.get_json())
+    if error:
+        return jsonify({'status': 'error', 'message': error})
+
+    session = current_session()
+    try:
+        # Input runs ahead of any queued screenshot so it is not stuck behind capture.
+        performed = session.scheduler.call(session.perform_input, events, priority=PRIORITY_INPUT)
+        session.rate.touch()
+        return jsonify({'status': 'success', 'performed': performed})
+
+    except StaleElementReferenceException:
+        return jsonify({'status': 'error', 'message': 'Element is stale'})
+    except ElementNotInteractableException:
+        return jsonify({'status': 'error', 'message': 'Element not interactable'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)})
 
 
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
-    global driver
-    if driver:
-        save_cookies(driver)
-        if SINGLE_PAGE and ls:
-            save_localstorage(ls)
-        driver.quit()
-        driver = None
-        print("Driver shut down.")
+    if sessions.close(current_session_id()):
         return jsonify({'status': 'success'})
     return jsonify({'status': 'error', 'message': 'Driver not initialized'})
 
+@app.route('/metrics')
+def metrics():
+    """Per-session driver queue wait times, viewers and capture rate."""
+    return jsonify({'sessions': {session_id: session.metrics()
+                                 for session_id, session in sessions.sessions().items()},
+                    'max_sessions': sessions.max_sessions,
+                    'warm_pool': warm_pool.metrics(),
+                    'reaped': reaper.reaped,
+                    'profiles': profiles.usage() if profiles else None,
+                    'rss_mb': round(process_tree_rss() / (1024 * 1024), 1)})
+
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=8080)
\ No newline at end of file
+    # Flask's debug server, for development; `python serve.py` serves the ASGI app in production.
+    # The reloader runs this module twice; only the process that serves requests binds the channel port.
+    if CHANNEL_PORT and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        serve_channels('0.0.0.0', CHANNEL_PORT, open_channel_session, SESSION_COOKIE)
+    app.run(debug=True, host='0.0.0.0', port=8080)